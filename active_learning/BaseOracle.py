@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 
@@ -5,3 +6,10 @@ class BaseOracle(ABC):
     @abstractmethod
     def get_labeled_samples(self, query_indices, data_storage):
         pass
+
+    async def get_labeled_samples_async(self, query_indices, data_storage):
+        # oracles talking to real annotators should override this, the default just
+        # keeps the event loop free by asking the synchronous oracle in a worker thread
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_labeled_samples, query_indices, data_storage
+        )
@@ -1,4 +1,5 @@
 import abc
+import asyncio
 import collections
 import itertools
 import random
@@ -11,7 +12,6 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.exceptions import NotFittedError
 from sklearn.metrics import accuracy_score
 from sklearn.model_selection import train_test_split
-from sklearn.semi_supervised import LabelPropagation, LabelSpreading
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.utils.class_weight import compute_sample_weight
 
@@ -21,6 +21,7 @@ from .experiment_setup_lib import (
     get_single_al_run_stats_table_header,
     log_it,
 )
+from .weak_supervision.baseWeakSupervision import get_all_labeled_samples
 
 
 class ActiveLearner:
@@ -37,6 +38,8 @@ class ActiveLearner:
         weak_supervision_label_sources=[],
     ):
         self.data_storage = dataset_storage
+        self.RANDOM_SEED = RANDOM_SEED
+        self.N_JOBS = N_JOBS
         self.NR_LEARNING_ITERATIONS = NR_LEARNING_ITERATIONS
         self.nr_queries_per_iteration = NR_QUERIES_PER_ITERATION
         self.clf = clf
@@ -56,6 +59,16 @@ class ActiveLearner:
         self.oracle = oracle
         self.weak_supervision_label_sources = weak_supervision_label_sources
 
+        self.current_iteration = 0
+        self.fit_time = 0
+        self.early_stop_reached = False
+        self.learning_stopped = False
+
+        self.speculative_candidates_factor = None
+        self.speculative_candidates = None
+        self.speculation_hits = 0
+        self.speculation_queries = 0
+
     @abc.abstractmethod
     def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
         pass
@@ -98,22 +111,171 @@ class ActiveLearner:
         self.metrics_per_al_cycle["train_conf_matrix"].append(conf_matrix)
         self.metrics_per_al_cycle["train_acc"].append(acc)
 
-    def get_newly_labeled_data(self):
+    def get_next_query_indices(self):
+        self.cluster_strategy.update_clusters()
+
         X_train_unlabeled_cluster_indices = self.cluster_strategy.get_cluster_indices(
             clf=self.clf, nr_queries_per_iteration=self.nr_queries_per_iteration
         )
 
         # ask strategy for new datapoint
-        query_indices = self.calculate_next_query_indices(
-            X_train_unlabeled_cluster_indices
-        )
+        return self.calculate_next_query_indices(X_train_unlabeled_cluster_indices)
 
-        X_query = self.data_storage.X_train_unlabeled.loc[query_indices]
+    def get_newly_labeled_data(self):
+        query_indices = self.get_next_query_indices()
 
         # ask oracle for new query
         Y_query = self.oracle.get_labeled_samples(query_indices, self.data_storage)
+        return self.get_labeled_query(query_indices, Y_query)
+
+    def get_labeled_query(self, query_indices, Y_query):
+        # oracles with several annotators may answer only a part of the batch
+        if len(Y_query) != len(query_indices) or not Y_query.index.equals(
+            pd.Index(query_indices)
+        ):
+            query_indices = Y_query.index.tolist()
+        X_query = self.data_storage.X_train_unlabeled.loc[query_indices]
         return X_query, Y_query, query_indices
 
+    def get_selection_state(self):
+        # everything a query selection advances besides the labels: the cursor of the
+        # cluster strategy and the rng of the data storage
+        return (
+            self.cluster_strategy.get_cursor(),
+            self.data_storage.rng.bit_generator.state,
+        )
+
+    def set_selection_state(self, selection_state):
+        cursor, rng_state = selection_state
+        self.cluster_strategy.set_cursor(cursor)
+        self.data_storage.rng.bit_generator.state = rng_state
+
+    def set_speculative_queries(self, candidates_factor):
+        # while the oracle is labeling, candidates_factor x nr_queries_per_iteration
+        # candidates for the next batch are ranked with the current model
+        self.speculative_candidates_factor = candidates_factor
+
+    def calculate_speculative_candidates(self, pending_query_indices):
+        pending_query_indices = set(pending_query_indices)
+
+        nr_queries_per_iteration = self.nr_queries_per_iteration
+        self.nr_queries_per_iteration = (
+            nr_queries_per_iteration * self.speculative_candidates_factor
+        )
+        try:
+            X_train_unlabeled_cluster_indices = {
+                cluster_id: [i for i in indices if i not in pending_query_indices]
+                for cluster_id, indices in self.cluster_strategy.get_cluster_indices(
+                    clf=self.clf,
+                    nr_queries_per_iteration=self.nr_queries_per_iteration,
+                ).items()
+            }
+            X_train_unlabeled_cluster_indices = {
+                cluster_id: indices
+                for cluster_id, indices in X_train_unlabeled_cluster_indices.items()
+                if len(indices) > 0
+            }
+            if len(X_train_unlabeled_cluster_indices) > 0:
+                self.speculative_candidates = list(
+                    self.calculate_next_query_indices(X_train_unlabeled_cluster_indices)
+                )
+        finally:
+            self.nr_queries_per_iteration = nr_queries_per_iteration
+
+    def get_speculative_query_indices(self):
+        # only the candidates which are still unlabeled are ranked again with the new model
+        candidates, self.speculative_candidates = self.speculative_candidates, None
+        if candidates is None:
+            return None
+
+        candidates = [
+            index
+            for index, unlabeled in zip(
+                candidates,
+                self.data_storage.pool_unlabeled_mask[
+                    self.data_storage.get_pool_positions(candidates)
+                ],
+            )
+            if unlabeled
+        ]
+        if len(candidates) < self.nr_queries_per_iteration:
+            return None
+
+        self.cluster_strategy.update_clusters()
+        return self.calculate_next_query_indices({0: candidates})
+
+    def validate_speculative_query_indices(self, query_indices):
+        # the model has not changed yet and the selection state is the one from before
+        # the batch was chosen, so the full ranking is what the batch would have been
+        # without speculation
+        full_query_indices = set(self.get_next_query_indices())
+        hits = len(full_query_indices.intersection(query_indices))
+
+        self.speculation_hits += hits
+        self.speculation_queries += len(query_indices)
+        log_it(
+            "Speculative queries: {}/{} hits, hit rate so far {:.2f}".format(
+                hits,
+                len(query_indices),
+                self.speculation_hits / max(self.speculation_queries, 1),
+            )
+        )
+
+    def get_weakly_labeled_data(self, MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS):
+        if (
+            self.metrics_per_al_cycle["test_acc"][-1]
+            > MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS
+        ):
+            # all WS sources run concurrently, the first one (in the given order) with a result wins
+            for label_source, (
+                X_query,
+                Y_query,
+                query_indices,
+                recommendation_value,
+            ) in zip(
+                self.weak_supervision_label_sources,
+                get_all_labeled_samples(self.weak_supervision_label_sources),
+            ):
+                # the sources after the winner keep their state as if never asked
+                label_source.commit_labeled_samples()
+                if X_query is not None:
+                    return X_query, Y_query, query_indices, recommendation_value
+        return None, None, None, None
+
+    def update_nr_queries_per_iteration(self):
+        # try to actively get at least this amount of data, but if there is only less data available that's just fine
+        if self.data_storage.X_train_unlabeled.shape[0] < self.nr_queries_per_iteration:
+            self.nr_queries_per_iteration = self.data_storage.X_train_unlabeled.shape[0]
+        return self.nr_queries_per_iteration
+
+    def add_labeled_queries(self, X_query, Y_query, query_indices, recommendation_value):
+        Y_query = Y_query.assign(source=recommendation_value)
+
+        self.metrics_per_al_cycle["recommendation"].append(recommendation_value)
+        self.metrics_per_al_cycle["query_length"].append(len(Y_query))
+        self.metrics_per_al_cycle["labels_indices"].append(str(query_indices))
+
+        self.data_storage.move_labeled_queries(X_query, Y_query, query_indices)
+        return Y_query
+
+    def retrain(self, X_query, Y_query):
+        self.calculate_pre_metrics(X_query, Y_query)
+
+        # retrain CLASSIFIER
+        self.fit_clf()
+
+        self.calculate_post_metrics(X_query, Y_query)
+
+    def log_iteration(self, i):
+        log_it(
+            get_single_al_run_stats_row(
+                i,
+                self.data_storage.X_train_labeled.shape[0],
+                self.data_storage.X_train_unlabeled.shape[0],
+                self.metrics_per_al_cycle,
+            )
+        )
+
     def learn(
         self,
         MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS,
@@ -129,18 +291,21 @@ class ActiveLearner:
         log_it(get_single_al_run_stats_table_header())
 
         self.start_set_size = len(self.data_storage.ground_truth_indices)
-        early_stop_reached = False
 
-        for i in range(0, self.NR_LEARNING_ITERATIONS):
-            # try to actively get at least this amount of data, but if there is only less data available that's just fine
-            if (
-                self.data_storage.X_train_unlabeled.shape[0]
-                < self.nr_queries_per_iteration
-            ):
-                self.nr_queries_per_iteration = self.data_storage.X_train_unlabeled.shape[
-                    0
-                ]
-            if self.nr_queries_per_iteration == 0:
+        if self.learning_stopped:
+            # an earlier call has already ended the learning for good
+            return (
+                self.clf,
+                self.metrics_per_al_cycle,
+                self.data_storage.Y_train_labeled,
+            )
+
+        # a later call with a higher NR_LEARNING_ITERATIONS continues where this one stops
+        for i in range(self.current_iteration, self.NR_LEARNING_ITERATIONS):
+            self.current_iteration = i + 1
+
+            if self.update_nr_queries_per_iteration() == 0:
+                self.learning_stopped = True
                 break
 
             # first iteration - add everything from ground truth
@@ -150,27 +315,18 @@ class ActiveLearner:
                 Y_query = self.data_storage.Y_train_unlabeled.loc[query_indices]
 
                 recommendation_value = "G"
-                Y_query_strong = None
             else:
-                X_query = None
-
-                if (
-                    self.metrics_per_al_cycle["test_acc"][-1]
-                    > MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS
-                ):
-                    # iterate over existing WS sources
-                    for labelSource in self.weak_supervision_label_sources:
-                        (
-                            X_query,
-                            Y_query,
-                            query_indices,
-                            recommendation_value,
-                        ) = labelSource.get_labeled_samples()
-
-                        if X_query is not None:
-                            break
+                (
+                    X_query,
+                    Y_query,
+                    query_indices,
+                    recommendation_value,
+                ) = self.get_weakly_labeled_data(
+                    MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS
+                )
 
-                if early_stop_reached and X_query is None:
+                if self.early_stop_reached and X_query is None:
+                    self.learning_stopped = True
                     break
 
                 if X_query is None:
@@ -179,36 +335,198 @@ class ActiveLearner:
                     recommendation_value = "A"
                     self.amount_of_user_asked_queries += len(Y_query)
 
-            Y_query = Y_query.assign(source=recommendation_value)
+            if len(Y_query) == 0:
+                # none of the annotators answered in time, the queries stay unlabeled
+                log_it("No labels received in iteration " + str(i))
+                continue
+
+            Y_query = self.add_labeled_queries(
+                X_query, Y_query, query_indices, recommendation_value
+            )
+
+            self.retrain(X_query, Y_query)
+
+            self.log_iteration(i)
+
+            if self.amount_of_user_asked_queries > USER_QUERY_BUDGET_LIMIT:
+                self.early_stop_reached = True
+                log_it("Budget exhausted")
+                if not ALLOW_RECOMMENDATIONS_AFTER_STOP:
+                    self.learning_stopped = True
+                    break
+
+        return (
+            self.clf,
+            self.metrics_per_al_cycle,
+            self.data_storage.Y_train_labeled,
+        )
+
+    def _speculate(self, pending_query_indices, validation_state):
+        # neither the validation nor the speculation may change which clusters and
+        # samples the real batches come from, or add to their metrics
+        selection_state = self.get_selection_state()
+        metrics_lengths = {
+            key: len(values) for key, values in self.metrics_per_al_cycle.items()
+        }
+        try:
+            if validation_state is not None:
+                self.set_selection_state(validation_state)
+                self.validate_speculative_query_indices(pending_query_indices)
+                self.set_selection_state(selection_state)
+            self.calculate_speculative_candidates(pending_query_indices)
+        finally:
+            self.set_selection_state(selection_state)
+            for key, length in metrics_lengths.items():
+                del self.metrics_per_al_cycle[key][length:]
+
+    async def learn_async(
+        self,
+        MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS,
+        ALLOW_RECOMMENDATIONS_AFTER_STOP,
+        USER_QUERY_BUDGET_LIMIT,
+        **kwargs,
+    ):
+        """Same loop as learn, but the oracle never waits for the learner
 
-            self.metrics_per_al_cycle["recommendation"].append(recommendation_value)
-            self.metrics_per_al_cycle["query_length"].append(len(Y_query))
-            self.metrics_per_al_cycle["labels_indices"].append(str(query_indices))
+        As soon as a batch has been added, the next query is calculated with the model
+        of the previous iteration and handed to the oracle. Retraining and evaluation on
+        the new batch then run in a worker thread while the oracle is labeling.
 
-            self.data_storage.move_labeled_queries(X_query, Y_query, query_indices)
+        With speculative queries the oracle always gets the queries of the newest model
+        instead, and the waiting time is used to rank candidates for the next batch.
+        """
+        log_it(self.data_storage.label_encoder.classes_)
+        log_it("Used Hyperparams:")
+        log_it(vars(self))
+        log_it(locals())
+
+        log_it(get_single_al_run_stats_table_header())
 
-            self.calculate_pre_metrics(X_query, Y_query)
+        self.start_set_size = len(self.data_storage.ground_truth_indices)
+
+        loop = asyncio.get_running_loop()
+        pending_query_indices = pending_labels = None
+        next_weak_query = (None, None, None, None)
+
+        if self.learning_stopped:
+            # an earlier call has already ended the learning for good
+            return (
+                self.clf,
+                self.metrics_per_al_cycle,
+                self.data_storage.Y_train_labeled,
+            )
 
-            # retrain CLASSIFIER
-            self.fit_clf()
+        # a later call with a higher NR_LEARNING_ITERATIONS continues where this one stops
+        for i in range(self.current_iteration, self.NR_LEARNING_ITERATIONS):
+            self.current_iteration = i + 1
 
-            self.calculate_post_metrics(X_query, Y_query)
+            if i == 0:
+                query_indices = self.data_storage.ground_truth_indices
+                X_query = self.data_storage.X_train_unlabeled.loc[query_indices]
+                Y_query = self.data_storage.Y_train_unlabeled.loc[query_indices]
 
-            log_it(
-                get_single_al_run_stats_row(
-                    i,
-                    self.data_storage.X_train_labeled.shape[0],
-                    self.data_storage.X_train_unlabeled.shape[0],
-                    self.metrics_per_al_cycle,
+                recommendation_value = "G"
+            elif pending_labels is not None:
+                X_query, Y_query, query_indices = self.get_labeled_query(
+                    pending_query_indices, await pending_labels
                 )
+                pending_query_indices = pending_labels = None
+
+                recommendation_value = "A"
+                self.amount_of_user_asked_queries += len(Y_query)
+            else:
+                if next_weak_query[0] is None:
+                    next_weak_query = self.get_weakly_labeled_data(
+                        MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS
+                    )
+                X_query, Y_query, query_indices, recommendation_value = next_weak_query
+                next_weak_query = (None, None, None, None)
+
+                if self.early_stop_reached and X_query is None:
+                    self.learning_stopped = True
+                    break
+
+                if X_query is None:
+                    if self.update_nr_queries_per_iteration() == 0:
+                        self.learning_stopped = True
+                        break
+
+                    # nothing has been prefetched, so wait for the oracle this time
+                    speculative_query_indices = None
+                    if self.speculative_candidates_factor is not None:
+                        # the validation replays the selection from this state
+                        validation_state = self.get_selection_state()
+                        speculative_query_indices = self.get_speculative_query_indices()
+
+                    if speculative_query_indices is not None:
+                        query_indices = speculative_query_indices
+                    else:
+                        query_indices = self.get_next_query_indices()
+                    labels = asyncio.ensure_future(
+                        self.oracle.get_labeled_samples_async(
+                            query_indices, self.data_storage
+                        )
+                    )
+
+                    if self.speculative_candidates_factor is not None:
+                        # use the waiting time to check the speculation and prepare the next one
+                        await loop.run_in_executor(
+                            None,
+                            self._speculate,
+                            query_indices,
+                            None
+                            if speculative_query_indices is None
+                            else validation_state,
+                        )
+                    X_query, Y_query, query_indices = self.get_labeled_query(
+                        query_indices, await labels
+                    )
+                    recommendation_value = "A"
+                    self.amount_of_user_asked_queries += len(Y_query)
+
+            if len(Y_query) == 0:
+                # none of the annotators answered in time, the queries stay unlabeled
+                log_it("No labels received in iteration " + str(i))
+                continue
+
+            Y_query = self.add_labeled_queries(
+                X_query, Y_query, query_indices, recommendation_value
             )
 
             if self.amount_of_user_asked_queries > USER_QUERY_BUDGET_LIMIT:
-                early_stop_reached = True
+                self.early_stop_reached = True
+
+            # prepare the next batch with the current model before retraining it
+            if i > 0 and i + 1 < self.NR_LEARNING_ITERATIONS:
+                next_weak_query = self.get_weakly_labeled_data(
+                    MINIMUM_TEST_ACCURACY_BEFORE_RECOMMENDATIONS
+                )
+                if (
+                    next_weak_query[0] is None
+                    and self.speculative_candidates_factor is None
+                    and not self.early_stop_reached
+                    and self.update_nr_queries_per_iteration() > 0
+                ):
+                    pending_query_indices = self.get_next_query_indices()
+                    pending_labels = asyncio.ensure_future(
+                        self.oracle.get_labeled_samples_async(
+                            pending_query_indices, self.data_storage
+                        )
+                    )
+
+            await loop.run_in_executor(None, self.retrain, X_query, Y_query)
+
+            self.log_iteration(i)
+
+            if self.early_stop_reached:
                 log_it("Budget exhausted")
                 if not ALLOW_RECOMMENDATIONS_AFTER_STOP:
+                    self.learning_stopped = True
                     break
 
+        if pending_labels is not None:
+            pending_labels.cancel()
+
         return (
             self.clf,
             self.metrics_per_al_cycle,
@@ -1,9 +1,7 @@
-import csv
-from pathlib import Path
+import asyncio
 import pandas as pd
 from collections import defaultdict
 import datetime
-import hashlib
 import math
 import operator
 import threading
@@ -25,12 +23,23 @@ from .dataStorage import DataStorage
 from .experiment_setup_lib import (
     calculate_global_score,
     conf_matrix_and_acc,
-    get_param_distribution,
+    get_param_list_id,
     init_logger,
 )
-from .sampling_strategies import BoundaryPairSampler, RandomSampler, UncertaintySampler
+from .labelLedger import CachingOracle, LabelLedger
+from .resultsWriter import get_results_writer
+from .sampling_strategies import (
+    BoundaryPairSampler,
+    CoreSetSampler,
+    DensityWeightedUncertaintySampler,
+    RandomSampler,
+    SheetBasedCommitteeSampler,
+    SheetBasedRandomSampler,
+    SheetBasedUncertaintySampler,
+    UncertaintySampler,
+)
 
-from .weak_supervision import WeakCert, WeakClust
+from .weak_supervision import LabelModel, SnubaLite, WeakCert, WeakClust, WeakSpread
 
 
 def train_al(
@@ -44,6 +53,7 @@ def train_al(
     TEST_FRACTION=None,
     X_test=None,
     Y_test=None,
+    groups=None,
 ):
     hyper_parameters["LEN_TRAIN_DATA"] = len(X_labeled)
     dataset_storage = DataStorage(hyper_parameters["RANDOM_SEED"])
@@ -59,6 +69,19 @@ def train_al(
         Y_test=Y_test,
     )
 
+    if groups is not None:
+        dataset_storage.set_pool_groups(groups)
+
+    dataset_storage.set_cache_directory(
+        hyper_parameters.get(
+            "CACHE_DIRECTORY", hyper_parameters["DATASETS_PATH"] + "/cache/"
+        )
+    )
+    dataset_storage.set_dimensionality_reduction(
+        hyper_parameters.get("DIMENSIONALITY_REDUCTION"),
+        hyper_parameters.get("DIMENSIONALITY_REDUCTION_COMPONENTS", 50),
+    )
+
     if hyper_parameters["CLUSTER"] == "dummy":
         cluster_strategy = DummyClusterStrategy()
     elif hyper_parameters["CLUSTER"] == "random":
@@ -76,6 +99,10 @@ def train_al(
         cluster_strategy = RoundRobinClusterStrategy()
 
     cluster_strategy.set_data_storage(dataset_storage, hyper_parameters["N_JOBS"])
+    cluster_strategy.set_reclustering(
+        hyper_parameters.get("RECLUSTER_POOL_SHRINK_RATIO"),
+        hyper_parameters.get("RECLUSTER_MINIMUM_CLUSTER_SIZE", 2),
+    )
 
     classifier = RandomForestClassifier(
         n_jobs=hyper_parameters["N_JOBS"], random_state=hyper_parameters["RANDOM_SEED"]
@@ -93,6 +120,9 @@ def train_al(
                 MINIMUM_RATIO_LABELED_UNLABELED=hyper_parameters[
                     "CLUSTER_RECOMMENDATION_RATIO_LABELED_UNLABELED"
                 ],
+                COARSER_LEVELS=hyper_parameters.get(
+                    "CLUSTER_RECOMMENDATION_COARSER_LEVELS", 0
+                ),
             )
         )
 
@@ -108,6 +138,47 @@ def train_al(
             )
         )
 
+    if hyper_parameters["WITH_SNUBA_LITE"]:
+        weak_supervision_label_sources.append(
+            SnubaLite(
+                dataset_storage,
+                MINIMUM_HEURISTIC_ACCURACY=hyper_parameters[
+                    "SNUBA_LITE_MINIMUM_HEURISTIC_ACCURACY"
+                ],
+                N_JOBS=hyper_parameters["N_JOBS"],
+            )
+        )
+
+    if hyper_parameters.get("WITH_LABEL_SPREADING", False):
+        weak_supervision_label_sources.append(
+            WeakSpread(
+                dataset_storage,
+                MINIMUM_CONFIDENCE=hyper_parameters.get(
+                    "LABEL_SPREADING_MINIMUM_CONFIDENCE", 0.9
+                ),
+                N_JOBS=hyper_parameters["N_JOBS"],
+            )
+        )
+
+    if (
+        hyper_parameters.get("WITH_LABEL_MODEL", False)
+        and len(weak_supervision_label_sources) > 0
+    ):
+        # aggregate the votes of all sources instead of taking the first one which returns something
+        weak_supervision_label_sources = [
+            LabelModel(
+                dataset_storage,
+                label_sources=weak_supervision_label_sources,
+                MINIMUM_CONFIDENCE=hyper_parameters.get(
+                    "LABEL_MODEL_MINIMUM_CONFIDENCE", 0.9
+                ),
+            )
+        ]
+
+    if hyper_parameters.get("LABEL_LEDGER") is not None:
+        # previously answered queries are served from the ledger instead of the oracle
+        oracle = CachingOracle(oracle, LabelLedger(hyper_parameters["LABEL_LEDGER"]))
+
     active_learner_params = {
         "dataset_storage": dataset_storage,
         "cluster_strategy": cluster_strategy,
@@ -133,27 +204,95 @@ def train_al(
     elif hyper_parameters["SAMPLING"] == "uncertainty_entropy":
         active_learner = UncertaintySampler(**active_learner_params)
         active_learner.set_uncertainty_strategy("entropy")
+    elif hyper_parameters["SAMPLING"] == "density_uncertainty_lc":
+        active_learner = DensityWeightedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("least_confident")
+    elif hyper_parameters["SAMPLING"] == "density_uncertainty_max_margin":
+        active_learner = DensityWeightedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("max_margin")
+    elif hyper_parameters["SAMPLING"] == "density_uncertainty_entropy":
+        active_learner = DensityWeightedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("entropy")
+    elif hyper_parameters["SAMPLING"] == "coreset":
+        active_learner = CoreSetSampler(**active_learner_params)
+    elif hyper_parameters["SAMPLING"] == "coreset_lc":
+        active_learner = CoreSetSampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("least_confident")
+    elif hyper_parameters["SAMPLING"] == "coreset_max_margin":
+        active_learner = CoreSetSampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("max_margin")
+    elif hyper_parameters["SAMPLING"] == "coreset_entropy":
+        active_learner = CoreSetSampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("entropy")
+    elif hyper_parameters["SAMPLING"].startswith("sheet_") and groups is None:
+        print("Sheet based sampling needs the groups of the rows, see --GROUP_COLUMN")
+        exit(-1)
+    elif hyper_parameters["SAMPLING"] == "sheet_random":
+        active_learner = SheetBasedRandomSampler(**active_learner_params)
+    elif hyper_parameters["SAMPLING"] == "sheet_uncertainty_lc":
+        active_learner = SheetBasedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("least_confident")
+    elif hyper_parameters["SAMPLING"] == "sheet_uncertainty_max_margin":
+        active_learner = SheetBasedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("max_margin")
+    elif hyper_parameters["SAMPLING"] == "sheet_uncertainty_entropy":
+        active_learner = SheetBasedUncertaintySampler(**active_learner_params)
+        active_learner.set_uncertainty_strategy("entropy")
+    elif hyper_parameters["SAMPLING"] == "sheet_committee":
+        active_learner = SheetBasedCommitteeSampler(**active_learner_params)
     #  elif hyper_parameters['sampling'] == 'committee':
     #  active_learner = CommitteeSampler(hyper_parameters['RANDOM_SEED, hyper_parameters.N_JOBS, hyper_parameters.NR_LEARNING_ITERATIONS)
     else:
         ("No Active Learning Strategy specified")
 
-    start = timer()
-    trained_active_clf_list, metrics_per_al_cycle, Y_train = active_learner.learn(
-        **hyper_parameters
+    if hyper_parameters.get("SPECULATIVE_QUERIES_FACTOR") is not None:
+        if not hyper_parameters.get("ASYNC_ORACLE", False) or hyper_parameters[
+            "SAMPLING"
+        ].startswith("sheet_"):
+            print(
+                "Speculative queries need ASYNC_ORACLE and can't be used with sheet based sampling"
+            )
+            exit(-1)
+        active_learner.set_speculative_queries(
+            hyper_parameters["SPECULATIVE_QUERIES_FACTOR"]
+        )
+
+    trained_active_clf_list, metrics_per_al_cycle, Y_train, fit_time = learn(
+        active_learner, hyper_parameters
     )
-    end = timer()
 
     return (
         trained_active_clf_list,
         Y_train,
-        end - start,
+        fit_time,
         metrics_per_al_cycle,
         dataset_storage,
         active_learner,
     )
 
 
+def learn(active_learner, hyper_parameters):
+    # the fit time adds up over all calls for the same active learner
+    start = timer()
+    if hyper_parameters.get("ASYNC_ORACLE", False):
+        trained_active_clf_list, metrics_per_al_cycle, Y_train = asyncio.run(
+            active_learner.learn_async(**hyper_parameters)
+        )
+    else:
+        trained_active_clf_list, metrics_per_al_cycle, Y_train = active_learner.learn(
+            **hyper_parameters
+        )
+    end = timer()
+    active_learner.fit_time += end - start
+
+    return (
+        trained_active_clf_list,
+        metrics_per_al_cycle,
+        Y_train,
+        active_learner.fit_time,
+    )
+
+
 def eval_al(
     X_test,
     Y_test,
@@ -206,12 +345,7 @@ def eval_al(
     #  "pickles/" + str(len(Y_train_al)) + "_" + param_list_id + ".pickle"
     #  )
 
-    # calculate based on params a unique id which should be the same across all similar cross validation splits
-    param_distribution = get_param_distribution(**hyper_parameters)
-    unique_params = ""
-    for k in param_distribution.keys():
-        unique_params += str(hyper_parameters[k])
-    param_list_id = hashlib.md5(unique_params.encode("utf-8")).hexdigest()
+    param_list_id = get_param_list_id(hyper_parameters)
     #  db = get_db(db_name_or_type=hyper_parameters["DB_NAME_OR_TYPE"])
 
     hyper_parameters["DATASET_NAME"] = dataset_name
@@ -234,19 +368,10 @@ def eval_al(
     hyper_parameters["end_time"] = datetime.datetime.now()
     hyper_parameters["amount_of_all_labels"] = amount_of_all_labels
 
-    # save hyper parameter results in csv file
-    output_hyper_parameter_file = Path(
+    # save hyper parameter results in csv file, batched and safe for concurrent runs
+    get_results_writer(
         hyper_parameters["output_directory"] + "/hyper_parameters.csv"
-    )
-    if not output_hyper_parameter_file.is_file():
-        output_hyper_parameter_file.touch()
-        with output_hyper_parameter_file.open("a") as f:
-            csv_writer = csv.DictWriter(f, fieldnames=hyper_parameters.keys())
-            csv_writer.writeheader()
-
-    with output_hyper_parameter_file.open("a") as f:
-        csv_writer = csv.DictWriter(f, fieldnames=hyper_parameters.keys())
-        csv_writer.writerow(hyper_parameters)
+    ).add_row(hyper_parameters)
 
     # save metrics_per_al_cycle in pickle file
     #      metrics_per_al_cycle=dumps(metrics_per_al_cycle, allow_nan=True),
@@ -284,6 +409,8 @@ def train_and_eval_dataset(
     label_encoder_classes,
     hyper_parameters,
     oracle,
+    groups=None,
+    return_active_learner=False,
 ):
     label_encoder = LabelEncoder()
     label_encoder.fit(label_encoder_classes)
@@ -306,6 +433,7 @@ def train_and_eval_dataset(
         TEST_FRACTION=hyper_parameters["TEST_FRACTION"],
         X_test=X_test,
         Y_test=Y_test,
+        groups=groups,
     )
 
     fit_score = eval_al(
@@ -323,4 +451,37 @@ def train_and_eval_dataset(
         X_train,
         Y_train,
     )
+    if return_active_learner:
+        return fit_score, Y_train_al, active_learner
+    return fit_score, Y_train_al
+
+
+def continue_and_eval_dataset(
+    dataset_name, X_train, X_test, Y_train, Y_test, active_learner, hyper_parameters,
+):
+    """Continues an already trained active learner up to the new NR_LEARNING_ITERATIONS
+
+    Used by the successive halving search, which promotes runs instead of restarting them.
+    """
+    active_learner.NR_LEARNING_ITERATIONS = hyper_parameters["NR_LEARNING_ITERATIONS"]
+
+    trained_active_clf_list, metrics_per_al_cycle, Y_train_al, fit_time = learn(
+        active_learner, hyper_parameters
+    )
+
+    fit_score = eval_al(
+        X_test,
+        Y_test,
+        active_learner.data_storage.label_encoder,
+        trained_active_clf_list,
+        fit_time,
+        metrics_per_al_cycle,
+        active_learner.data_storage,
+        active_learner,
+        hyper_parameters,
+        dataset_name,
+        Y_train_al,
+        X_train,
+        Y_train,
+    )
     return fit_score, Y_train_al
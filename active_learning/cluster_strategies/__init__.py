@@ -1,4 +1,5 @@
 from .baseClusterStrategy import *
+from .clusterTree import *
 from .dummyClusterStrategy import *
 from .mostUncertainClusterStrategy import *
 from .randomClusterStrategy import *
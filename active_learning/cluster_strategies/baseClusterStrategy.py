@@ -14,9 +14,14 @@ from sklearn.cluster import (
 )
 
 from ..experiment_setup_lib import log_it
+from .clusterTree import ClusterTree
 
 
 class BaseClusterStrategy:
+    # None disables the reclustering, otherwise small clusters get merged every time the unlabeled pool shrank to this ratio
+    recluster_pool_shrink_ratio = None
+    recluster_minimum_cluster_size = 2
+
     def _entropy(self, labels):
         n_labels = len(labels)
         if n_labels <= 1:
@@ -38,7 +43,7 @@ class BaseClusterStrategy:
 
     def set_data_storage(self, data_storage, n_jobs=-1):
         self.data_storage = data_storage
-        # first run pca to downsample data
+        # first run pca to downsample data (see DataStorage.set_dimensionality_reduction)
 
         X_train_combined = pd.concat(
             [self.data_storage.X_train_labeled, self.data_storage.X_train_unlabeled]
@@ -46,8 +51,10 @@ class BaseClusterStrategy:
         self.X_train_combined = X_train_combined
         n_samples, n_features = X_train_combined.shape
 
-        # then cluster it
-        self.cluster_model = AgglomerativeClustering(n_clusters=int(n_samples / 8))
+        # then cluster it, the full merge tree is kept so that clusters of other granularities are available without clustering again
+        self.cluster_model = AgglomerativeClustering(
+            n_clusters=int(n_samples / 8), compute_full_tree=True
+        )
         #  distance_threshold=1,
         #  n_clusters=None,
         #  )
@@ -59,9 +66,9 @@ class BaseClusterStrategy:
         #  batch_size=min(int(n_samples / 100), int(n_features)),
         #  )
 
-        self.Y_train_unlabeled_cluster = self.cluster_model.fit_predict(
-            self.data_storage.X_train_unlabeled
-        )
+        self.cluster_model.fit(self.data_storage.get_X_train_pool_reduced())
+        self.data_storage.cluster_tree = ClusterTree(self.cluster_model.children_)
+        self.set_granularity(int(n_samples / 8))
 
         #  self.cluster_model = OPTICS(min_cluster_size=20, n_jobs=n_jobs)
         #  with np.errstate(divide="ignore"):
@@ -71,8 +78,6 @@ class BaseClusterStrategy:
         #  self.Y_train_unlabeled_cluster = self.cluster_model.labels_[
         #  self.cluster_model.ordering_
         #  ]
-        counter = Counter(self.Y_train_unlabeled_cluster)
-        self.n_clusters = len([1 for _ in counter.most_common()])
 
         #  log_it(
         #      "Clustering into "
@@ -81,20 +86,6 @@ class BaseClusterStrategy:
         #      + str(counter.most_common())
         #  )
 
-        self.data_storage.X_train_unlabeled_cluster_indices = defaultdict(
-            lambda: list()
-        )
-        self.data_storage.X_train_labeled_cluster_indices = defaultdict(lambda: list())
-
-        for cluster_index, X_train_index in zip(
-            self.Y_train_unlabeled_cluster,
-            #  self.data_storage.Y_train_unlabeled[0]
-            self.data_storage.X_train_unlabeled.index,
-        ):
-            self.data_storage.X_train_unlabeled_cluster_indices[cluster_index].append(
-                X_train_index
-            )
-
         data = []
 
         #  for (
@@ -121,6 +112,37 @@ class BaseClusterStrategy:
         #  print(self.data_storage.X_train_unlabeled)
         #  exit(-1)
 
+    def get_cursor(self):
+        # state which get_cluster_indices advances, None for stateless strategies
+        return None
+
+    def set_cursor(self, cursor):
+        pass
+
+    def set_granularity(self, n_clusters):
+        # only cuts the existing cluster tree at a different level
+        self.data_storage.set_cluster_granularity(n_clusters)
+        self.Y_train_unlabeled_cluster = self.data_storage.pool_cluster_ids
+        self.n_clusters = n_clusters
+        self.pool_size_at_last_clustering = len(self.data_storage.X_train_unlabeled)
+
+    def set_reclustering(self, pool_shrink_ratio, minimum_cluster_size=2):
+        self.recluster_pool_shrink_ratio = pool_shrink_ratio
+        self.recluster_minimum_cluster_size = minimum_cluster_size
+
+    def update_clusters(self):
+        # incremental instead of clustering everything again: leftover clusters are merged along the cluster tree
+        if self.recluster_pool_shrink_ratio is None:
+            return
+
+        pool_size = len(self.data_storage.X_train_unlabeled)
+        if (
+            pool_size
+            <= self.pool_size_at_last_clustering * self.recluster_pool_shrink_ratio
+        ):
+            self.data_storage.merge_small_clusters(self.recluster_minimum_cluster_size)
+            self.pool_size_at_last_clustering = pool_size
+
     @abc.abstractmethod
     def get_cluster_indices(self, **kwargs):
         # return X_train_unlabeled
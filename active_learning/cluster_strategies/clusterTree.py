@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class ClusterTree:
+    """Complete merge tree of an agglomerative clustering
+
+    Leaves 0..n_samples-1 are the clustered samples, the i-th merge creates the node
+    n_samples + i (same convention as sklearn's children_ and scipy's linkage).
+    Clusters of every granularity are nodes of this tree, so switching between
+    granularities never requires clustering again.
+    """
+
+    def __init__(self, children):
+        self.children = np.asarray(children, dtype=np.int64).reshape(-1, 2)
+        self.n_samples = len(self.children) + 1
+        n_nodes = 2 * self.n_samples - 1
+
+        self.parents = np.full(n_nodes, -1, dtype=np.int64)
+        self.parents[self.children.ravel()] = np.repeat(
+            np.arange(self.n_samples, n_nodes), 2
+        )
+
+        # amount of leaves below each node
+        self.sizes = np.ones(n_nodes, dtype=np.int64)
+        for i, (a, b) in enumerate(self.children):
+            self.sizes[self.n_samples + i] = self.sizes[a] + self.sizes[b]
+
+        # order the leaves so that the leaves of every node form one contiguous slice
+        self.leaf_start = np.zeros(n_nodes, dtype=np.int64)
+        for i in range(len(self.children) - 1, -1, -1):
+            a, b = self.children[i]
+            self.leaf_start[a] = self.leaf_start[self.n_samples + i]
+            self.leaf_start[b] = self.leaf_start[self.n_samples + i] + self.sizes[a]
+
+        self.leaf_order = np.empty(self.n_samples, dtype=np.int64)
+        self.leaf_order[self.leaf_start[: self.n_samples]] = np.arange(self.n_samples)
+
+        self._cuts = {}
+
+    def get_cluster_ids(self, n_clusters):
+        """node id of the cluster each leaf belongs to if the tree is cut into n_clusters"""
+        n_clusters = min(max(n_clusters, 1), self.n_samples)
+
+        if n_clusters not in self._cuts:
+            nr_merges = self.n_samples - n_clusters
+            node_ids = np.arange(len(self.parents))
+
+            # a node is a cluster of this cut if it exists already but its parent does not
+            exists = node_ids < self.n_samples + nr_merges
+            parent_exists = (self.parents != -1) & (
+                self.parents < self.n_samples + nr_merges
+            )
+            clusters = np.flatnonzero(exists & ~parent_exists)
+            clusters = clusters[np.argsort(self.leaf_start[clusters])]
+
+            cluster_ids = np.empty(self.n_samples, dtype=np.int64)
+            cluster_ids[self.leaf_order] = np.repeat(clusters, self.sizes[clusters])
+            self._cuts[n_clusters] = cluster_ids
+        return self._cuts[n_clusters]
+
+    def get_parent_cluster(self, cluster_id):
+        """the next coarser cluster containing cluster_id, -1 for the root"""
+        return self.parents[cluster_id]
+
+    def get_leaves(self, cluster_id):
+        start = self.leaf_start[cluster_id]
+        return self.leaf_order[start : start + self.sizes[cluster_id]]
@@ -19,6 +19,7 @@ class MostUncertainClusterStrategy(BaseClusterStrategy):
             cluster_id,
             cluster_indices,
         ) in self.data_storage.X_train_unlabeled_cluster_indices.items():
+            cluster_indices = list(cluster_indices)
             # calculate most uncertainty per
             Y_temp_proba = clf.predict_proba(
                 self.data_storage.X_train_unlabeled.loc[cluster_indices]
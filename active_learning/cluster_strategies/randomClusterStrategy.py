@@ -1,14 +1,26 @@
-import random
-
+from ..dataStorage import IndexPool
 from .baseClusterStrategy import BaseClusterStrategy
 
 
 class RandomClusterStrategy(BaseClusterStrategy):
+    cluster_id_pool = None
+
+    def set_granularity(self, n_clusters):
+        super(RandomClusterStrategy, self).set_granularity(n_clusters)
+        self.cluster_id_pool = None
+
     def _get_random_cluster(self):
-        # randomly select cluster
-        random_cluster = random.choice(
-            list(self.data_storage.X_train_unlabeled_cluster_indices.keys())
-        )
+        if self.cluster_id_pool is None:
+            self.cluster_id_pool = IndexPool(
+                self.data_storage.X_train_unlabeled_cluster_indices.keys()
+            )
+
+        # randomly select cluster, clusters which have been emptied in the meantime are dropped lazily
+        while True:
+            random_cluster = self.cluster_id_pool.sample(1, self.data_storage.rng)[0]
+            if random_cluster in self.data_storage.X_train_unlabeled_cluster_indices:
+                break
+            self.cluster_id_pool.remove(random_cluster)
 
         #  for cluster, cluster_indices in self.dataset_storage.X_train_unlabeled_cluster_indices.items(
         #  ):
@@ -26,7 +38,7 @@ class RandomClusterStrategy(BaseClusterStrategy):
                 ]
             }
 
-        random_indices = random.sample(
-            self.data_storage.X_train_unlabeled_cluster_indices[random_cluster], k=k
-        )
+        random_indices = self.data_storage.X_train_unlabeled_cluster_indices[
+            random_cluster
+        ].sample(k, self.data_storage.rng)
         return {random_cluster: random_indices}
@@ -1,35 +1,48 @@
-import random
-from collections import defaultdict
+from collections import deque
 
 from .baseClusterStrategy import BaseClusterStrategy
 
 
 class RoundRobinClusterStrategy(BaseClusterStrategy):
-    def get_random_cluster(self):
-        self.Y_train_unlabeled_cluster = self.cluster_model.fit_predict(
-            self.pca.transform(self.X_train_unlabeled)
-        )
-
-        self.X_train_unlabeled_clustered = defaultdict(lambda: list())
-        for index, Y in enumerate(self.Y_train_unlabeled_cluster):
-            self.X_train_unlabeled_clustered[Y].append(index)
-
-        # randomly select cluster
-        random_cluster = random.sample(range(0, self.n_clusters_), k=1)[0]
-        return random_cluster
-
-    def get_oracle_cluster(self):
-        random_cluster = self.get_random_cluster()
-        k = self.nr_queries_per_iteration
-        if k > len(self.X_train_unlabeled_clustered[random_cluster]):
-            return self.X_train_unlabeled_clustered[random_cluster]
-
-        random_indices = random.sample(
-            self.X_train_unlabeled_clustered[random_cluster], k=k
-        )
-
-        return random_indices
-
-    def get_global_query_indice(self, cluster_query_indices):
-        # return global_query_indices
-        pass
+    cluster_rotation = None
+
+    def set_granularity(self, n_clusters):
+        super(RoundRobinClusterStrategy, self).set_granularity(n_clusters)
+        self.cluster_rotation = None
+
+    def get_cursor(self):
+        if self.cluster_rotation is None:
+            return None
+        return deque(self.cluster_rotation)
+
+    def set_cursor(self, cursor):
+        self.cluster_rotation = None if cursor is None else deque(cursor)
+
+    def _get_next_cluster(self):
+        if self.cluster_rotation is None:
+            self.cluster_rotation = deque(
+                self.data_storage.X_train_unlabeled_cluster_indices.keys()
+            )
+
+        # rotating cursor over the precomputed clusters, exhausted clusters are dropped on the way
+        while self.cluster_rotation:
+            cluster = self.cluster_rotation.popleft()
+            if cluster in self.data_storage.X_train_unlabeled_cluster_indices:
+                self.cluster_rotation.append(cluster)
+                return cluster
+        return None
+
+    def get_cluster_indices(self, nr_queries_per_iteration, **kwargs):
+        cluster = self._get_next_cluster()
+        if cluster is None:
+            return {}
+
+        k = nr_queries_per_iteration
+        if k > len(self.data_storage.X_train_unlabeled_cluster_indices[cluster]):
+            return {cluster: self.data_storage.X_train_unlabeled_cluster_indices[cluster]}
+
+        return {
+            cluster: self.data_storage.X_train_unlabeled_cluster_indices[
+                cluster
+            ].sample(k, self.data_storage.rng)
+        }
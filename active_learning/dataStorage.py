@@ -1,11 +1,79 @@
+import hashlib
 import random
-from collections import Counter
+from collections import Counter, defaultdict
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import PCA
 from sklearn.model_selection import train_test_split
+from sklearn.random_projection import SparseRandomProjection
 
 from .experiment_setup_lib import log_it
+from .neighborIndex import NeighborIndex
+
+
+class IndexPool:
+    """Unordered collection of indices with O(1) removal and O(k) random sampling
+
+    Removed indices are swapped with the last element of the backing array, so the
+    pool never has to be rebuilt or materialized for sampling.
+    """
+
+    def __init__(self, indices=()):
+        self._indices = list(indices)
+        self._positions = {
+            index: position for position, index in enumerate(self._indices)
+        }
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __iter__(self):
+        return iter(self._indices)
+
+    def __contains__(self, index):
+        return index in self._positions
+
+    def __getitem__(self, position):
+        return self._indices[position]
+
+    def __array__(self, dtype=None):
+        return np.array(self._indices, dtype=dtype)
+
+    def __repr__(self):
+        return "IndexPool(" + repr(self._indices) + ")"
+
+    def _swap(self, position_a, position_b):
+        index_a = self._indices[position_a]
+        index_b = self._indices[position_b]
+        self._indices[position_a] = index_b
+        self._indices[position_b] = index_a
+        self._positions[index_b] = position_a
+        self._positions[index_a] = position_b
+
+    def append(self, index):
+        self._positions[index] = len(self._indices)
+        self._indices.append(index)
+
+    def remove(self, index):
+        self._swap(self._positions[index], len(self._indices) - 1)
+        self._indices.pop()
+        del self._positions[index]
+
+    def sample(self, k, rng):
+        # partial Fisher-Yates shuffle: the k drawn indices are moved to the end of the
+        # array, the swaps are undone afterwards, so sampling never reorders the pool
+        k = min(k, len(self._indices))
+        n = len(self._indices)
+        swaps = rng.integers(0, n - np.arange(k))
+        for i, j in enumerate(swaps):
+            self._swap(j, n - 1 - i)
+        sample = self._indices[n - k :]
+        for i in range(k - 1, -1, -1):
+            self._swap(swaps[i], n - 1 - i)
+        return sample
 
 
 class DataStorage:
@@ -13,6 +81,20 @@ class DataStorage:
         if random_seed != -1:
             np.random.seed(random_seed)
             random.seed(random_seed)
+            self.rng = np.random.default_rng(random_seed)
+        else:
+            self.rng = np.random.default_rng()
+
+        self.neighbor_index = None
+        self.pool_densities = {}
+        self.pool_group_ids = None
+        self.cluster_tree = None
+        self.cache_directory = None
+        self.dataset_fingerprint = None
+        self.fingerprint = None
+        self.knn_graphs = {}
+        self.random_seed = None if random_seed == -1 else random_seed
+        self.set_dimensionality_reduction(None)
 
     def set_training_data(
         self,
@@ -149,6 +231,340 @@ class DataStorage:
 
         self.Y_train_strong_labels = pd.DataFrame.copy(original_Y_train_labeled)
 
+        # at this point all training data is stored in X_train_unlabeled
+        # afterwards rows only move from unlabeled to labeled, so this ordering stays fixed
+        # and everything computed per row position (neighbors, densities, ...) can be reused for the whole AL cycle
+        self.X_train_pool = self.X_train_unlabeled
+        self.pool_index = self.X_train_pool.index
+        self.pool_unlabeled_mask = np.ones(len(self.pool_index), dtype=bool)
+        self.pool_cluster_ids = np.full(len(self.pool_index), -1)
+        self.pool_labels = np.full(len(self.pool_index), -1)
+
+        # label frequencies per cluster id, together with the clusters changed since they were last looked at
+        self.cluster_label_counts = None
+        self.changed_clusters = set()
+
+    def set_dimensionality_reduction(self, method, n_components=50):
+        """method is one of None, "pca", "randomized_pca" or "random_projection"
+
+        clustering and all distance based strategies run in the reduced space
+        """
+        self.dimensionality_reduction = method
+        self.dimensionality_reduction_components = n_components
+        self.dimensionality_reducer = None
+        self.X_train_pool_reduced = None
+        # the fingerprint of the cached artifacts depends on the reduction
+        self.fingerprint = None
+
+    def get_X_train_pool_reduced(self):
+        # computed only once per dataset
+        if self.X_train_pool_reduced is None:
+            X_train_pool = self.X_train_pool.to_numpy()
+            n_components = self.dimensionality_reduction_components
+
+            if self.dimensionality_reduction is None or n_components >= min(
+                X_train_pool.shape
+            ):
+                self.dimensionality_reducer = None
+            elif self.dimensionality_reduction == "pca":
+                self.dimensionality_reducer = PCA(n_components=n_components)
+            elif self.dimensionality_reduction == "randomized_pca":
+                self.dimensionality_reducer = PCA(
+                    n_components=n_components,
+                    svd_solver="randomized",
+                    random_state=self.random_seed,
+                )
+            elif self.dimensionality_reduction == "random_projection":
+                self.dimensionality_reducer = SparseRandomProjection(
+                    n_components=n_components, random_state=self.random_seed
+                )
+            else:
+                print(
+                    "Unknown dimensionality reduction " + self.dimensionality_reduction
+                )
+                exit(-1)
+
+            cache_path = self.get_cache_path("reduced_features.npy")
+
+            if self.dimensionality_reducer is None:
+                self.X_train_pool_reduced = X_train_pool
+            elif cache_path is not None and cache_path.is_file():
+                # the fingerprint covers the pool and the reduction settings
+                self.X_train_pool_reduced = np.load(cache_path)
+            else:
+                self.X_train_pool_reduced = self.dimensionality_reducer.fit_transform(
+                    X_train_pool
+                ).astype(np.float32)
+                if cache_path is not None:
+                    # concurrent runs never load a half written file
+                    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+                    with open(tmp_path, "wb") as f:
+                        np.save(f, self.X_train_pool_reduced)
+                    tmp_path.replace(cache_path)
+                log_it(
+                    "Reduced "
+                    + str(X_train_pool.shape)
+                    + " to "
+                    + str(self.X_train_pool_reduced.shape)
+                    + " using "
+                    + self.dimensionality_reduction
+                )
+        return self.X_train_pool_reduced
+
+    def get_pool_positions(self, indices):
+        return self.pool_index.get_indexer(list(indices))
+
+    def set_cluster_granularity(self, n_clusters):
+        # clusters of a different granularity are just another cut through the cluster tree
+        self.n_clusters = n_clusters
+        self.pool_cluster_ids = self.cluster_tree.get_cluster_ids(n_clusters).copy()
+
+        self.X_train_unlabeled_cluster_indices = defaultdict(IndexPool)
+        self.X_train_labeled_cluster_indices = defaultdict(list)
+
+        for cluster_id, indice, unlabeled in zip(
+            self.pool_cluster_ids, self.pool_index, self.pool_unlabeled_mask
+        ):
+            if unlabeled:
+                self.X_train_unlabeled_cluster_indices[cluster_id].append(indice)
+            else:
+                self.X_train_labeled_cluster_indices[cluster_id].append(indice)
+
+        # indexed by cluster id, which are the node ids of the cluster tree
+        self.cluster_label_counts = np.zeros(
+            (len(self.cluster_tree.parents), len(self.label_encoder.classes_)),
+            dtype=np.int64,
+        )
+        np.add.at(
+            self.cluster_label_counts,
+            (
+                self.pool_cluster_ids[~self.pool_unlabeled_mask],
+                self.pool_labels[~self.pool_unlabeled_mask],
+            ),
+            1,
+        )
+        self.changed_clusters = set(self.X_train_unlabeled_cluster_indices.keys())
+
+    def _get_unlabeled_counts(self):
+        # unlabeled samples below every tree node, the leaves of a node are one slice
+        tree = self.cluster_tree
+        unlabeled_before = np.concatenate(
+            [[0], np.cumsum(self.pool_unlabeled_mask[tree.leaf_order])]
+        )
+        return (
+            unlabeled_before[tree.leaf_start + tree.sizes]
+            - unlabeled_before[tree.leaf_start]
+        )
+
+    def _get_merge_target(self, cluster_id, unlabeled_counts):
+        # the closest cluster in the cluster tree which still contains unlabeled
+        # samples, found in O(tree depth) by following the unlabeled counts of the nodes
+        tree = self.cluster_tree
+
+        # the unlabeled samples of cluster_id itself don't count, as ranks in leaf order
+        own_ranks = tree.leaf_start[
+            self.get_pool_positions(self.X_train_unlabeled_cluster_indices[cluster_id])
+        ]
+
+        def _count(node):
+            start = tree.leaf_start[node]
+            return unlabeled_counts[node] - np.count_nonzero(
+                (own_ranks >= start) & (own_ranks < start + tree.sizes[node])
+            )
+
+        node = cluster_id
+        while tree.get_parent_cluster(node) != -1:
+            parent = tree.get_parent_cluster(node)
+            left, right = tree.children[parent - tree.n_samples]
+            sibling = right if left == node else left
+
+            if _count(sibling) > 0:
+                # descend to the first unlabeled sample below the sibling
+                while sibling >= tree.n_samples:
+                    left, right = tree.children[sibling - tree.n_samples]
+                    sibling = left if _count(left) > 0 else right
+                return self.pool_cluster_ids[sibling]
+            node = parent
+        return None
+
+    def merge_small_clusters(self, minimum_cluster_size):
+        """merges clusters with less than minimum_cluster_size unlabeled samples into their closest cluster
+
+        only the samples of the merged clusters are touched, the remaining clusters stay as they are
+        """
+        small_clusters = [
+            cluster_id
+            for cluster_id, cluster_indices in self.X_train_unlabeled_cluster_indices.items()
+            if len(cluster_indices) < minimum_cluster_size
+        ]
+
+        # merging only moves samples between clusters, the unlabeled counts stay valid
+        unlabeled_counts = self._get_unlabeled_counts()
+
+        amount_of_merged_clusters = 0
+        for cluster_id in small_clusters:
+            if cluster_id not in self.X_train_unlabeled_cluster_indices:
+                continue
+
+            target = self._get_merge_target(cluster_id, unlabeled_counts)
+            if target is None:
+                continue
+
+            unlabeled_indices = list(
+                self.X_train_unlabeled_cluster_indices.pop(cluster_id)
+            )
+            labeled_indices = self.X_train_labeled_cluster_indices.pop(cluster_id, [])
+
+            for indice in unlabeled_indices:
+                self.X_train_unlabeled_cluster_indices[target].append(indice)
+            self.X_train_labeled_cluster_indices[target].extend(labeled_indices)
+
+            self.pool_cluster_ids[
+                self.get_pool_positions(unlabeled_indices + list(labeled_indices))
+            ] = target
+            self.cluster_label_counts[target] += self.cluster_label_counts[cluster_id]
+            self.cluster_label_counts[cluster_id] = 0
+            self.changed_clusters.update([cluster_id, target])
+            amount_of_merged_clusters += 1
+
+        log_it(
+            "Merged "
+            + str(amount_of_merged_clusters)
+            + " small clusters, "
+            + str(len(self.X_train_unlabeled_cluster_indices))
+            + " clusters left"
+        )
+
+    def set_pool_groups(self, groups):
+        # groups (e.g. the spreadsheet a table row belongs to) are stored as int ids per pool position
+        groups = pd.Series(groups).reindex(self.pool_index)
+        self.pool_group_ids, self.pool_group_names = pd.factorize(groups)
+
+        # rows without a group (factorized to -1) become groups of their own
+        ungrouped = self.pool_group_ids == -1
+        if ungrouped.any():
+            self.pool_group_ids[ungrouped] = len(self.pool_group_names) + np.arange(
+                ungrouped.sum()
+            )
+            self.pool_group_names = self.pool_group_names.append(
+                pd.Index(["row " + str(i) for i in self.pool_index[ungrouped]])
+            )
+
+        # pool positions sorted by group -> the members of a group are one contiguous slice
+        self.pool_group_order = np.argsort(self.pool_group_ids, kind="stable")
+        self.pool_group_offsets = np.searchsorted(
+            self.pool_group_ids[self.pool_group_order],
+            np.arange(len(self.pool_group_names) + 1),
+        )
+
+    def get_unlabeled_group_positions(self, group_id):
+        members = self.pool_group_order[
+            self.pool_group_offsets[group_id] : self.pool_group_offsets[group_id + 1]
+        ]
+        return members[self.pool_unlabeled_mask[members]]
+
+    def get_neighbor_index(self, n_neighbors=10, n_jobs=-1):
+        # computed only once per dataset, afterwards only the cached neighbors are being queried
+        n_neighbors = min(n_neighbors, len(self.pool_index) - 1)
+        if (
+            self.neighbor_index is None
+            or self.neighbor_index.n_neighbors < n_neighbors
+        ):
+            cache_path = self.get_cache_path("neighbors_" + str(n_neighbors))
+
+            if cache_path is not None and NeighborIndex.exists(cache_path):
+                self.neighbor_index = NeighborIndex.load(cache_path)
+            else:
+                self.neighbor_index = NeighborIndex.build(
+                    self.get_X_train_pool_reduced(),
+                    n_neighbors=n_neighbors,
+                    n_jobs=n_jobs,
+                )
+                if cache_path is not None:
+                    self.neighbor_index.save(cache_path)
+        return self.neighbor_index
+
+    def get_pool_densities(self, n_neighbors=10, n_jobs=-1):
+        # density of a row is the mean similarity to its k nearest neighbors
+        if n_neighbors not in self.pool_densities:
+            distances, _ = self.get_neighbor_index(n_neighbors, n_jobs).kneighbors(
+                n_neighbors=n_neighbors
+            )
+            self.pool_densities[n_neighbors] = np.mean(1 / (1 + distances), axis=1)
+        return self.pool_densities[n_neighbors]
+
+    def set_cache_directory(self, cache_directory):
+        # artifacts which only depend on the dataset are stored here and reused by later runs
+        self.cache_directory = cache_directory
+
+    def get_dataset_fingerprint(self):
+        # identifies the rows of the training pool, a row id always refers to the same sample
+        if self.dataset_fingerprint is None:
+            md5 = hashlib.md5()
+            md5.update(str(self.X_train_pool.shape).encode("utf-8"))
+            md5.update(np.ascontiguousarray(self.pool_index.to_numpy()).tobytes())
+            md5.update(np.ascontiguousarray(self.X_train_pool.to_numpy()).tobytes())
+            self.dataset_fingerprint = md5.hexdigest()
+        return self.dataset_fingerprint
+
+    def get_fingerprint(self):
+        # identifies the training pool (including its ordering) and the feature space
+        if self.fingerprint is None:
+            md5 = hashlib.md5()
+            md5.update(self.get_dataset_fingerprint().encode("utf-8"))
+            md5.update(
+                (
+                    str(self.dimensionality_reduction)
+                    + str(self.dimensionality_reduction_components)
+                    + str(self.random_seed)
+                ).encode("utf-8")
+            )
+            self.fingerprint = md5.hexdigest()
+        return self.fingerprint
+
+    def get_cache_path(self, name):
+        if self.cache_directory is None:
+            return None
+        cache_directory = Path(self.cache_directory)
+        cache_directory.mkdir(parents=True, exist_ok=True)
+        return cache_directory / (self.get_fingerprint() + "_" + name)
+
+    def get_knn_graph(self, n_neighbors=10, n_jobs=-1):
+        """symmetrically normalized sparse kNN affinity matrix over the pool positions"""
+        if n_neighbors not in self.knn_graphs:
+            cache_path = self.get_cache_path("knn_graph_" + str(n_neighbors) + ".npz")
+
+            if cache_path is not None and cache_path.is_file():
+                self.knn_graphs[n_neighbors] = sparse.load_npz(cache_path)
+            else:
+                distances, neighbors = self.get_neighbor_index(
+                    n_neighbors, n_jobs
+                ).kneighbors(n_neighbors=n_neighbors)
+                n_pool, n_neighbors_found = neighbors.shape
+
+                # rbf weights, the bandwidth is the median distance to the k-th neighbor
+                sigma = max(np.median(distances[:, -1]), 1e-12)
+                rows = np.repeat(np.arange(n_pool), n_neighbors_found)
+                affinities = sparse.csr_matrix(
+                    (np.exp(-((distances.ravel() / sigma) ** 2)), (rows, neighbors.ravel())),
+                    shape=(n_pool, n_pool),
+                )
+                affinities = affinities.maximum(affinities.T)
+
+                degrees = np.asarray(affinities.sum(axis=1)).ravel()
+                degrees_inv_sqrt = sparse.diags(
+                    1 / np.sqrt(np.maximum(degrees, 1e-12))
+                )
+                knn_graph = (degrees_inv_sqrt @ affinities @ degrees_inv_sqrt).tocsr()
+
+                if cache_path is not None:
+                    # save_npz appends .npz to any other suffix
+                    tmp_path = cache_path.with_name(cache_path.name + ".tmp.npz")
+                    sparse.save_npz(tmp_path, knn_graph)
+                    tmp_path.replace(cache_path)
+                self.knn_graphs[n_neighbors] = knn_graph
+        return self.knn_graphs[n_neighbors]
+
     def _print_data_segmentation(self):
         len_train_labeled = len(self.X_train_labeled)
         len_train_unlabeled = len(self.X_train_unlabeled)
@@ -183,22 +599,25 @@ class DataStorage:
         self.Y_train_unlabeled = self.Y_train_unlabeled.drop(
             query_indices, errors="ignore"
         )
-
-        # remove indices from all clusters in unlabeled and add to labeled
-        for cluster_id in self.X_train_unlabeled_cluster_indices.keys():
-            list_to_be_removed_and_appended = []
-            for indice in query_indices:
-                if indice in self.X_train_unlabeled_cluster_indices[cluster_id]:
-                    list_to_be_removed_and_appended.append(indice)
-
-            # don't change a list you're iterating over!
-            for indice in list_to_be_removed_and_appended:
-                self.X_train_unlabeled_cluster_indices[cluster_id].remove(indice)
+        query_positions = self.get_pool_positions(query_indices)
+        self.pool_unlabeled_mask[query_positions] = False
+        self.pool_labels[self.get_pool_positions(Y_query.index)] = Y_query[0].to_numpy()
+
+        # remove indices from their cluster in unlabeled and add to labeled
+        for indice, query_position, cluster_id in zip(
+            query_indices, query_positions, self.pool_cluster_ids[query_positions]
+        ):
+            if cluster_id not in self.X_train_unlabeled_cluster_indices:
+                continue
+            cluster_indices = self.X_train_unlabeled_cluster_indices[cluster_id]
+            if indice in cluster_indices:
+                cluster_indices.remove(indice)
                 self.X_train_labeled_cluster_indices[cluster_id].append(indice)
-
-        # remove possible empty clusters
-        self.X_train_unlabeled_cluster_indices = {
-            k: v
-            for k, v in self.X_train_unlabeled_cluster_indices.items()
-            if len(v) != 0
-        }
+                self.cluster_label_counts[
+                    cluster_id, self.pool_labels[query_position]
+                ] += 1
+                self.changed_clusters.add(cluster_id)
+
+                # remove possible empty clusters
+                if len(cluster_indices) == 0:
+                    del self.X_train_unlabeled_cluster_indices[cluster_id]
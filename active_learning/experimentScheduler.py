@@ -0,0 +1,206 @@
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .al_cycle_wrapper import train_and_eval_dataset
+from .experiment_setup_lib import get_dataset, init_logger, log_it
+from .parallelismGovernor import ParallelismGovernor
+
+# datasets already loaded by this worker process,
+# (path, name, seed, group column) -> splits
+_datasets = {}
+
+
+def _init_worker(core_sets, governor, log_file):
+    # every worker is pinned to its own set of cores, so runs never compete for a core
+    cores = core_sets.get()
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    governor.limit_threads()
+    init_logger(log_file)
+
+
+def _load_dataset(datasets_path, dataset_name, random_seed, group_column):
+    # the groups of the training rows are None if the sampling doesn't need them
+    if group_column is None:
+        return get_dataset(datasets_path, dataset_name, random_seed) + (None,)
+    return get_dataset(
+        datasets_path, dataset_name, random_seed, group_column=group_column
+    )
+
+
+def _get_dataset(datasets_path, dataset_name, random_seed, group_column=None):
+    key = (datasets_path, dataset_name, random_seed, group_column)
+    if random_seed == -1:
+        # a new random split for every run
+        return _load_dataset(datasets_path, dataset_name, random_seed, group_column)
+    if key not in _datasets:
+        _datasets[key] = _load_dataset(
+            datasets_path, dataset_name, random_seed, group_column
+        )
+
+    # the runs must not change the cached splits
+    X_train, X_test, Y_train, Y_test, label_encoder_classes, groups = _datasets[key]
+    return (
+        X_train.copy(),
+        X_test.copy(),
+        Y_train.copy(),
+        Y_test.copy(),
+        label_encoder_classes,
+        groups,
+    )
+
+
+def _prepare_experiment(hyper_parameters, dataset_name, governor):
+    hyper_parameters = governor.apply(dict(hyper_parameters))
+
+    if hyper_parameters["RANDOM_SEED"] == -2:
+        hyper_parameters["RANDOM_SEED"] = random.randint(0, 2147483647)
+    if hyper_parameters["RANDOM_SEED"] != -1:
+        np.random.seed(hyper_parameters["RANDOM_SEED"])
+        random.seed(hyper_parameters["RANDOM_SEED"])
+
+    splits = _get_dataset(
+        hyper_parameters["DATASETS_PATH"],
+        dataset_name,
+        hyper_parameters["RANDOM_SEED"],
+        hyper_parameters.get("GROUP_COLUMN"),
+    )
+    return hyper_parameters, splits
+
+
+def _run_experiment(hyper_parameters, dataset_name, oracle_factory, governor):
+    hyper_parameters, splits = _prepare_experiment(
+        hyper_parameters, dataset_name, governor
+    )
+    X_train, X_test, Y_train, Y_test, label_encoder_classes, groups = splits
+
+    start = time.time()
+    score, _ = train_and_eval_dataset(
+        dataset_name,
+        X_train,
+        X_test,
+        Y_train,
+        Y_test,
+        label_encoder_classes,
+        hyper_parameters=hyper_parameters,
+        oracle=oracle_factory(),
+        groups=groups,
+    )
+    return score, time.time() - start
+
+
+class ExperimentScheduler:
+    """Runs AL experiments on a fixed number of pinned worker processes
+
+    The available cores are split by a ParallelismGovernor into equally sized, disjoint
+    sets of cores_per_run cores, one for each worker, and every run gets
+    N_JOBS=cores_per_run. Config samples are pulled lazily from an iterator, so that
+    only a few runs are queued at any time, and results are yielded as soon as a run
+    has finished. Every worker loads a dataset only once and reuses it for all of its
+    following runs, the workers are kept alive until shutdown is called.
+    """
+
+    def __init__(self, n_jobs=-1, cores_per_run=1, log_file="log.txt"):
+        self.governor = ParallelismGovernor(n_jobs, threads_per_run=cores_per_run)
+        self.cores_per_run = self.governor.threads_per_run
+        self.n_workers = self.governor.n_workers
+        self.core_sets = self.governor.get_core_sets()
+        self.log_file = log_file
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _get_executor(self):
+        if self.executor is None:
+            context = multiprocessing.get_context()
+            core_sets = context.Queue()
+            for cores in self.core_sets:
+                core_sets.put(cores)
+
+            log_it(
+                "Scheduling experiments on {} workers with {} cores each".format(
+                    self.n_workers, self.cores_per_run
+                )
+            )
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(core_sets, self.governor, self.log_file),
+            )
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def map_unordered(self, task, task_arguments):
+        """Yields (arguments, result) of task(*arguments, governor) in order of completion
+
+        The second argument is the dataset name, failed tasks are logged and skipped.
+        """
+        task_arguments = iter(task_arguments)
+        executor = self._get_executor()
+        running = {}
+
+        def _submit(amount):
+            for arguments in itertools.islice(task_arguments, amount):
+                future = executor.submit(task, *arguments, self.governor)
+                running[future] = arguments
+
+        # a second run per worker is queued already, so no worker waits for the next sample
+        _submit(2 * self.n_workers)
+        while len(running) > 0:
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                arguments = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_it("Experiment on {} failed: {!r}".format(arguments[1], e))
+                    continue
+                yield arguments, result
+            _submit(len(done))
+
+    def run(
+        self, hyper_parameter_samples, dataset_names, oracle_factory, checkpoint=None
+    ):
+        """Yields (hyper_parameters, dataset_name, score, run_time) in order of completion
+
+        Runs which have already finished according to the SearchCheckpoint are not run
+        again, their stored score is yielded with a run_time of 0.
+        """
+        finished = []
+
+        def _experiments():
+            for hyper_parameters in hyper_parameter_samples:
+                hyper_parameters = self.governor.apply(dict(hyper_parameters))
+                for dataset_name in dataset_names:
+                    if checkpoint is not None:
+                        score = checkpoint.get_fit_score(hyper_parameters, dataset_name)
+                        if score is not None:
+                            finished.append((hyper_parameters, dataset_name, score, 0))
+                            continue
+                    yield hyper_parameters, dataset_name, oracle_factory
+
+        for (
+            (hyper_parameters, dataset_name, _),
+            (score, run_time),
+        ) in self.map_unordered(_run_experiment, _experiments()):
+            while len(finished) > 0:
+                yield finished.pop(0)
+            yield hyper_parameters, dataset_name, score, run_time
+
+        while len(finished) > 0:
+            yield finished.pop(0)
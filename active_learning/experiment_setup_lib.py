@@ -1,6 +1,7 @@
 from sklearn.metrics import accuracy_score
 import argparse
 import datetime
+import hashlib
 import os
 import random
 import sys
@@ -55,6 +56,12 @@ def standard_config(additional_parameters=None, standard_args=True):
         )
         parser.add_argument("--TEST_FRACTION", type=float, default=0.5)
         parser.add_argument("--LOG_FILE", type=str, default="log.txt")
+        parser.add_argument(
+            "--GROUP_COLUMN",
+            default=None,
+            help="Column of dwtc/aft.csv with the spreadsheet of each row, needed for "
+            "the sheet_* sampling",
+        )
 
     if additional_parameters is not None:
         for additional_parameter in additional_parameters:
@@ -199,8 +206,17 @@ def prettify_bytes(bytes):
     return str(amount) + suffix
 
 
-def get_dataset(datasets_path, dataset_name, RANDOM_SEED, **kwargs):
+def get_dataset(
+    datasets_path, dataset_name, RANDOM_SEED, group_column=None, **kwargs
+):
+    """Returns X_train, X_test, Y_train, Y_test, label_encoder_classes
+
+    If group_column is given, the groups of the training rows (e.g. the spreadsheet of
+    a dwtc table row) are returned as sixth element, indexed like X_train. The column
+    is not used as a feature.
+    """
     log_it("Loading " + dataset_name)
+    groups = None
 
     if dataset_name == "dwtc":
         df = pd.read_csv(datasets_path + "/dwtc/aft.csv", index_col="id")
@@ -210,6 +226,12 @@ def get_dataset(datasets_path, dataset_name, RANDOM_SEED, **kwargs):
 
         Y_temp = df.pop("CLASS").to_numpy()
 
+        if group_column is not None:
+            if group_column not in df.columns:
+                print("Group column " + group_column + " not found in dwtc/aft.csv")
+                exit(-1)
+            groups = df.pop(group_column).to_numpy()
+
         # replace labels with strings
         #  Y_temp = Y_temp.astype("str")
         #  for i in range(0, 40):
@@ -257,6 +279,10 @@ def get_dataset(datasets_path, dataset_name, RANDOM_SEED, **kwargs):
         "zebra": 30744,
     }
 
+    if group_column is not None and groups is None:
+        print("Only dwtc rows can be grouped, " + dataset_name + " has no groups")
+        exit(-1)
+
     if dataset_name in train_indices:
         train_num = train_indices[dataset_name]
     else:
@@ -287,6 +313,9 @@ def get_dataset(datasets_path, dataset_name, RANDOM_SEED, **kwargs):
     Y_test = Y_temp[train_num:]
 
     log_it("Loaded " + dataset_name)
+    if group_column is not None:
+        groups_train = pd.Series(groups[:train_num], index=X_train.index)
+        return X_train, X_test, Y_train, Y_test, label_encoder.classes_, groups_train
     return X_train, X_test, Y_train, Y_test, label_encoder.classes_
 
 
@@ -439,3 +468,12 @@ def get_param_distribution(
     }
 
     return param_distribution
+
+
+def get_param_list_id(hyper_parameters):
+    # calculate based on params a unique id which should be the same across all similar cross validation splits
+    param_distribution = get_param_distribution(**hyper_parameters)
+    unique_params = ""
+    for k in param_distribution.keys():
+        unique_params += str(hyper_parameters[k])
+    return hashlib.md5(unique_params.encode("utf-8")).hexdigest()
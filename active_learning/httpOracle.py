@@ -0,0 +1,138 @@
+import http.client
+import json
+import queue
+import random
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from .BaseOracle import BaseOracle
+from .experiment_setup_lib import log_it
+
+
+class HttpOracle(BaseOracle):
+    """Asks an HTTP labeling service for the labels of a whole query batch at once
+
+    The service gets a POST request with the JSON body
+    {"indices": [...], "annotator": ...} and answers with {"labels": [...]} in the
+    same order, using the original class names. Samples the service could not label
+    are returned as null and stay unlabeled.
+
+    Connections are kept alive in a pool so that concurrent calls (e.g. from an
+    OracleDispatcher) don't open a new connection for every batch. Failed requests are
+    retried with exponential backoff.
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        url,
+        annotator=None,
+        timeout=60,
+        max_retries=5,
+        backoff_factor=0.5,
+        pool_size=8,
+    ):
+        url = urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path or "/"
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+
+        self.annotator = annotator
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # idle keep-alive connections, at most pool_size of them are kept around
+        self.connection_pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self):
+        try:
+            return self.connection_pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release_connection(self, connection):
+        try:
+            self.connection_pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _post(self, body):
+        body = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        for attempt in range(self.max_retries + 1):
+            connection = self._get_connection()
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # the server might have closed an idle keep-alive connection
+                connection.close()
+                error = e
+            else:
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._release_connection(connection)
+
+                if response.status == 200:
+                    return json.loads(response_body)
+                if response.status not in self.RETRY_STATUS_CODES:
+                    raise http.client.HTTPException(
+                        "Labeling service answered with "
+                        + str(response.status)
+                        + ": "
+                        + response_body.decode("utf-8", errors="replace")
+                    )
+                error = "HTTP " + str(response.status)
+
+            if attempt < self.max_retries:
+                delay = self.backoff_factor * 2 ** attempt * random.uniform(0.5, 1.5)
+                log_it(
+                    "Labeling service request failed ({}), retrying in {:.2f}s".format(
+                        error, delay
+                    )
+                )
+                time.sleep(delay)
+
+        raise http.client.HTTPException(
+            "Labeling service unreachable after "
+            + str(self.max_retries + 1)
+            + " attempts: "
+            + str(error)
+        )
+
+    def get_labeled_samples(self, query_indices, data_storage):
+        query_indices = list(query_indices)
+        response = self._post(
+            {
+                "indices": [
+                    index.item() if isinstance(index, np.generic) else index
+                    for index in query_indices
+                ],
+                "annotator": self.annotator,
+            }
+        )
+
+        labels = pd.Series(response["labels"], index=query_indices).dropna()
+        return pd.DataFrame(
+            data_storage.label_encoder.transform(
+                labels.to_numpy().astype(data_storage.label_encoder.classes_.dtype)
+            ),
+            index=labels.index,
+        )
+
+    def close(self):
+        while not self.connection_pool.empty():
+            self.connection_pool.get_nowait().close()
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .BaseOracle import BaseOracle
+from .experiment_setup_lib import log_it
+
+
+class LabelLedger:
+    """Persistent store of all labels a (human) oracle has ever given
+
+    Labels are stored with their original class name and keyed by the dataset
+    fingerprint and the row id. The SQLite database runs in WAL mode, so that many
+    concurrent experiments can read while one of them is writing.
+    """
+
+    # SQLite supports at most 999 variables per statement in older versions
+    MAX_VARIABLES = 900
+
+    def __init__(self, path):
+        self.path = path
+        self._connect()
+
+    def __getstate__(self):
+        # e.g. when an active learner is checkpointed, only the path can be pickled
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._connect()
+
+    def _connect(self):
+        path = self.path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            str(path), timeout=60, check_same_thread=False
+        )
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                "dataset TEXT NOT NULL, "
+                "row_id TEXT NOT NULL, "
+                "label TEXT NOT NULL, "
+                "annotator TEXT, "
+                "created REAL NOT NULL, "
+                "PRIMARY KEY (dataset, row_id)"
+                ") WITHOUT ROWID"
+            )
+
+    def get_labels(self, dataset, row_ids):
+        # row id -> class name of all already known rows
+        labels = {}
+        row_ids = [str(row_id) for row_id in row_ids]
+        with self.lock:
+            for start in range(0, len(row_ids), self.MAX_VARIABLES):
+                chunk = row_ids[start : start + self.MAX_VARIABLES]
+                for row_id, label in self.connection.execute(
+                    "SELECT row_id, label FROM labels WHERE dataset = ? AND row_id IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    [dataset] + chunk,
+                ):
+                    labels[row_id] = json.loads(label)
+        return labels
+
+    def add_labels(self, dataset, labels, annotator=None):
+        # labels is a mapping of row id -> class name
+        created = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        dataset,
+                        str(row_id),
+                        json.dumps(
+                            label.item() if isinstance(label, np.generic) else label
+                        ),
+                        None if annotator is None else str(annotator),
+                        created,
+                    )
+                    for row_id, label in labels.items()
+                ],
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachingOracle(BaseOracle):
+    """Answers queries from the label ledger, only misses are sent to the wrapped oracle"""
+
+    def __init__(self, oracle, ledger, annotator=None):
+        self.oracle = oracle
+        self.ledger = ledger
+        self.annotator = annotator
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached_labels(self, query_indices, data_storage):
+        cached_labels = self.ledger.get_labels(
+            data_storage.get_dataset_fingerprint(), query_indices
+        )
+        misses = [index for index in query_indices if str(index) not in cached_labels]
+        return cached_labels, misses
+
+    def _combine(self, query_indices, cached_labels, Y_misses, data_storage):
+        label_encoder = data_storage.label_encoder
+
+        if Y_misses is not None and len(Y_misses) > 0:
+            self.ledger.add_labels(
+                data_storage.get_dataset_fingerprint(),
+                dict(
+                    zip(
+                        Y_misses.index,
+                        label_encoder.inverse_transform(Y_misses[0].to_numpy()),
+                    )
+                ),
+                annotator=self.annotator,
+            )
+
+        hits = [index for index in query_indices if str(index) in cached_labels]
+        self.hits += len(hits)
+        self.misses += len(query_indices) - len(hits)
+        log_it(
+            "Label ledger: {} hits, {} misses".format(
+                len(hits), len(query_indices) - len(hits)
+            )
+        )
+
+        Y_hits = pd.DataFrame(
+            label_encoder.transform(
+                np.array(
+                    [cached_labels[str(index)] for index in hits],
+                    dtype=label_encoder.classes_.dtype,
+                )
+            ),
+            index=hits,
+        )
+        if Y_misses is None or len(Y_misses) == 0:
+            return Y_hits
+
+        # same order as the query, so that runs with and without ledger are identical,
+        # partial (or late) answers of the wrapped oracle are passed on as they are
+        # an empty or differently typed Y_hits would upcast the labels of the misses
+        query_order = {index: i for i, index in enumerate(query_indices)}
+        if len(hits) == 0:
+            Y_query = Y_misses[[0]]
+        else:
+            Y_query = pd.concat([Y_hits.astype(Y_misses[0].dtype), Y_misses[[0]]])
+        return Y_query.iloc[
+            np.argsort(
+                [query_order.get(index, len(query_order)) for index in Y_query.index],
+                kind="stable",
+            )
+        ]
+
+    def get_labeled_samples(self, query_indices, data_storage):
+        query_indices = list(query_indices)
+        cached_labels, misses = self._get_cached_labels(query_indices, data_storage)
+
+        Y_misses = None
+        if len(misses) > 0:
+            Y_misses = self.oracle.get_labeled_samples(misses, data_storage)
+        return self._combine(query_indices, cached_labels, Y_misses, data_storage)
+
+    async def get_labeled_samples_async(self, query_indices, data_storage):
+        query_indices = list(query_indices)
+        cached_labels, misses = self._get_cached_labels(query_indices, data_storage)
+
+        Y_misses = None
+        if len(misses) > 0:
+            Y_misses = await self.oracle.get_labeled_samples_async(misses, data_storage)
+        return self._combine(query_indices, cached_labels, Y_misses, data_storage)
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.utils import get_chunk_n_rows
+from sklearn.utils.extmath import row_norms
+
+
+class NeighborIndex:
+    """k nearest neighbors of every row of the training pool
+
+    Rows are addressed by their position in DataStorage.pool_index, the neighbors of
+    a row never contain the row itself. The index is stored as two int32/float32 .npy
+    arrays, so that later runs can memory map it instead of rebuilding it.
+    """
+
+    # upper bound in MB for the temporary distance matrices of all parallel chunks
+    WORKING_MEMORY = 256
+
+    def __init__(self, distances, indices):
+        self.distances = distances
+        self.indices = indices
+        self.n_neighbors = indices.shape[1]
+
+    @classmethod
+    def build(cls, X, n_neighbors=10, n_jobs=-1, chunk_size=None):
+        X = np.asarray(X, dtype=np.float64)
+        n_neighbors = min(n_neighbors, len(X) - 1)
+        if n_neighbors < 1:
+            raise ValueError(
+                "A neighbor index needs n_neighbors >= 1 and at least two rows"
+            )
+
+        if chunk_size is None:
+            # every chunk holds a float64 distance and an int64 argpartition matrix
+            chunk_size = get_chunk_n_rows(
+                row_bytes=16 * len(X) * effective_n_jobs(n_jobs),
+                max_n_rows=len(X),
+                working_memory=cls.WORKING_MEMORY,
+            )
+        X_norm_squared = row_norms(X, squared=True)[np.newaxis, :]
+
+        def _chunk_neighbors(start):
+            distances = euclidean_distances(
+                X[start : start + chunk_size], X, Y_norm_squared=X_norm_squared
+            )
+
+            # exclude the row itself, duplicates of it are still valid neighbors
+            rows = np.arange(len(distances))
+            distances[rows, start + rows] = np.inf
+
+            indices = np.argpartition(distances, n_neighbors - 1, axis=1)[
+                :, :n_neighbors
+            ]
+            distances = np.take_along_axis(distances, indices, axis=1)
+
+            order = np.argsort(distances, axis=1, kind="stable")
+            return (
+                np.take_along_axis(distances, order, axis=1).astype(np.float32),
+                np.take_along_axis(indices, order, axis=1).astype(np.int32),
+            )
+
+        # brute force over chunks of rows, memory is bounded by WORKING_MEMORY
+        chunks = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_chunk_neighbors)(start) for start in range(0, len(X), chunk_size)
+        )
+        return cls(
+            np.concatenate([distances for distances, _ in chunks]),
+            np.concatenate([indices for _, indices in chunks]),
+        )
+
+    @classmethod
+    def load(cls, path_prefix):
+        return cls(
+            np.load(str(path_prefix) + "_distances.npy", mmap_mode="r"),
+            np.load(str(path_prefix) + "_indices.npy", mmap_mode="r"),
+        )
+
+    @staticmethod
+    def exists(path_prefix):
+        return (
+            Path(str(path_prefix) + "_distances.npy").is_file()
+            and Path(str(path_prefix) + "_indices.npy").is_file()
+        )
+
+    def save(self, path_prefix):
+        # written to a temporary file first so concurrent runs never load half an index
+        for name, array in (
+            ("_distances.npy", self.distances),
+            ("_indices.npy", self.indices),
+        ):
+            tmp_path = Path(str(path_prefix) + name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            tmp_path.replace(str(path_prefix) + name)
+
+    def kneighbors(self, positions=None, n_neighbors=None):
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+        if positions is None:
+            return self.distances[:, :n_neighbors], self.indices[:, :n_neighbors]
+        return (
+            self.distances[positions, :n_neighbors],
+            self.indices[positions, :n_neighbors],
+        )
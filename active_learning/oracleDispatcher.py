@@ -0,0 +1,164 @@
+import asyncio
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .BaseOracle import BaseOracle
+from .experiment_setup_lib import log_it
+
+
+class OracleDispatcher(BaseOracle):
+    """Shards every query batch across several annotators which label concurrently
+
+    Each annotator is a BaseOracle of its own. Answers are collected as they arrive,
+    an annotator which exceeds its timeout keeps on labeling in the background and its
+    late answers are handed out together with the next batch. The returned labels can
+    therefore be only a part of the query batch (or contain older queries), learners
+    have to use the index of the returned labels.
+    """
+
+    def __init__(self, annotators, timeouts=None, minimum_batch_fraction=1.0):
+        self.annotators = annotators
+        if timeouts is None or np.isscalar(timeouts):
+            timeouts = [timeouts] * len(annotators)
+        self.timeouts = timeouts
+        self.minimum_batch_fraction = minimum_batch_fraction
+
+        # annotator id -> (task, query indices) of a shard which is not collected yet
+        self.busy_annotators = {}
+        self.loop = None
+
+    def _get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return self.loop
+
+    def get_labeled_samples(self, query_indices, data_storage):
+        # asyncio.run would wait for the worker threads of slow annotators when closing
+        # its loop, a loop kept running in the background lets them outlive this call
+        return asyncio.run_coroutine_threadsafe(
+            self.get_labeled_samples_async(query_indices, data_storage),
+            self._get_loop(),
+        ).result()
+
+    async def get_labeled_samples_async(self, query_indices, data_storage):
+        loop = asyncio.get_running_loop()
+
+        # shards from a previous event loop can't be awaited anymore
+        self.busy_annotators = {
+            annotator_id: (task, shard)
+            for annotator_id, (task, shard) in self.busy_annotators.items()
+            if task.get_loop() is loop
+        }
+
+        if len(self.busy_annotators) == len(self.annotators):
+            # everyone is still busy, so wait for the first one to become available
+            await asyncio.wait(
+                [task for task, _ in self.busy_annotators.values()],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+        idle_annotators = [
+            annotator_id
+            for annotator_id in range(len(self.annotators))
+            if annotator_id not in self.busy_annotators
+            or self.busy_annotators[annotator_id][0].done()
+        ]
+        late_tasks = [
+            self.busy_annotators.pop(annotator_id)[0]
+            for annotator_id in idle_annotators
+            if annotator_id in self.busy_annotators
+        ]
+
+        # samples still being labeled by a slow annotator are not handed out twice
+        outstanding_indices = set()
+        for _, shard in self.busy_annotators.values():
+            outstanding_indices.update(shard)
+        query_indices = [
+            index for index in query_indices if index not in outstanding_indices
+        ]
+
+        shards = [
+            shard
+            for shard in np.array_split(
+                np.array(query_indices, dtype=object), len(idle_annotators)
+            )
+            if len(shard) > 0
+        ]
+
+        now = loop.time()
+        tasks = {}
+        for annotator_id, shard in zip(idle_annotators, shards):
+            task = asyncio.ensure_future(
+                self.annotators[annotator_id].get_labeled_samples_async(
+                    shard.tolist(), data_storage
+                )
+            )
+            timeout = self.timeouts[annotator_id]
+            tasks[task] = (
+                annotator_id,
+                shard.tolist(),
+                None if timeout is None else now + timeout,
+            )
+
+        # collect the answers as they arrive until enough of the batch is labeled or all
+        # remaining annotators have exceeded their timeout
+        results = [
+            task.result()
+            for task in late_tasks
+            if not task.cancelled() and task.exception() is None
+        ]
+        amount_of_labels = 0
+        pending = set(tasks.keys())
+        while len(pending) > 0:
+            if amount_of_labels >= self.minimum_batch_fraction * len(query_indices):
+                break
+
+            deadlines = [
+                tasks[task][2] for task in pending if tasks[task][2] is not None
+            ]
+            timeout = (
+                None if len(deadlines) == 0 else max(0, min(deadlines) - loop.time())
+            )
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                annotator_id, shard, _ = tasks[task]
+                if task.cancelled() or task.exception() is not None:
+                    log_it(
+                        "Annotator {} failed: {}".format(
+                            annotator_id,
+                            "cancelled" if task.cancelled() else task.exception(),
+                        )
+                    )
+                    continue
+                results.append(task.result())
+                amount_of_labels += len(shard)
+
+            # annotators whose timeout has passed are not waited for anymore
+            now = loop.time()
+            for task in list(pending):
+                annotator_id, shard, deadline = tasks[task]
+                if deadline is not None and deadline <= now:
+                    pending.remove(task)
+                    self.busy_annotators[annotator_id] = (task, shard)
+
+        for task in pending:
+            annotator_id, shard, _ = tasks[task]
+            self.busy_annotators[annotator_id] = (task, shard)
+
+        if len(results) == 0:
+            return pd.DataFrame(columns=[0])
+
+        Y_query = pd.concat(results)
+        Y_query = Y_query[~Y_query.index.duplicated()]
+
+        # late answers might belong to samples which have been labeled in the meantime
+        return Y_query.loc[
+            data_storage.pool_unlabeled_mask[
+                data_storage.get_pool_positions(Y_query.index)
+            ]
+        ]
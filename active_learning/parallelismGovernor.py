@@ -0,0 +1,64 @@
+import os
+
+from threadpoolctl import threadpool_info, threadpool_limits
+
+
+def get_available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+class ParallelismGovernor:
+    """Splits a core budget between concurrent runs and the threads inside each run
+
+    n_workers x threads_per_run never exceeds the budget. Inside a run, the threads are
+    used by the classifier (N_JOBS) and by the BLAS/OpenMP thread pools, which are
+    limited with threadpoolctl, so nested parallelism can't oversubscribe the cores.
+    """
+
+    def __init__(self, n_jobs=-1, n_workers=None, threads_per_run=None):
+        cores = get_available_cores()
+        if n_jobs > 0:
+            cores = cores[:n_jobs]
+        self.cores = cores
+
+        if threads_per_run is None and n_workers is None:
+            threads_per_run = 1
+        if threads_per_run is None:
+            n_workers = max(1, min(n_workers, len(cores)))
+            threads_per_run = max(1, len(cores) // n_workers)
+        else:
+            threads_per_run = max(1, min(threads_per_run, len(cores)))
+            n_workers = max(1, len(cores) // threads_per_run)
+
+        self.n_workers = n_workers
+        self.threads_per_run = threads_per_run
+        self._thread_limiter = None
+
+    def get_core_sets(self):
+        # disjoint cores for every worker
+        return [
+            self.cores[i * self.threads_per_run : (i + 1) * self.threads_per_run]
+            for i in range(self.n_workers)
+        ]
+
+    def limit_threads(self):
+        # has to be called inside every worker process, the limit stays until the process ends
+        self._thread_limiter = threadpool_limits(limits=self.threads_per_run)
+
+    def apply(self, hyper_parameters):
+        # the classifier and all other joblib users of a run get exactly their share
+        hyper_parameters["N_JOBS"] = self.threads_per_run
+        hyper_parameters.update(self.get_metadata())
+        return hyper_parameters
+
+    def get_metadata(self):
+        return {
+            "PARALLEL_CORES": len(self.cores),
+            "PARALLEL_WORKERS": self.n_workers,
+            "THREADS_PER_RUN": self.threads_per_run,
+            "BLAS_THREADS": max(
+                [pool["num_threads"] for pool in threadpool_info()], default=None
+            ),
+        }
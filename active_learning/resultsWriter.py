@@ -0,0 +1,137 @@
+import csv
+import fcntl
+import json
+import os
+import threading
+import time
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+from .experiment_setup_lib import get_param_distribution, log_it
+
+# fixed column order of hyper_parameters.csv, all other hyper parameters are stored as
+# JSON in the extra_parameters column
+RESULT_FIELDS = (
+    [k.lower() for k in get_param_distribution().keys()]
+    + [
+        "dataset_name",
+        "len_train_data",
+        "amount_of_user_asked_queries",
+        "cores",
+        "parallel_cores",
+        "parallel_workers",
+        "threads_per_run",
+        "blas_threads",
+        "fit_time",
+        "metrics_per_al_cycle",
+        "acc_train",
+        "acc_test",
+        "acc_test_oracle",
+        "fit_score",
+        "param_list_id",
+        "thread_id",
+        "end_time",
+        "amount_of_all_labels",
+    ]
+    + ["extra_parameters"]
+)
+
+# one writer per results file and process, path -> ResultsWriter
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class ResultsWriter:
+    """Batches result rows in memory and appends them to a csv file under an exclusive lock
+
+    Any number of processes can write to the same file: every flush takes an flock on
+    a lock file next to it, so rows are never interleaved and the header is written
+    exactly once. Rows are flushed when batch_size rows are buffered, every
+    flush_interval seconds from a background thread, and when the process exits.
+    """
+
+    def __init__(self, path, batch_size=32, flush_interval=10):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+
+        self.rows = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+        # also runs in multiprocessing workers, which skip the atexit handlers
+        Finalize(self, self.close, exitpriority=10)
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def _to_row(self, result):
+        row = {}
+        extra_parameters = {}
+        for k, v in result.items():
+            if k in RESULT_FIELDS:
+                row[k] = v
+            else:
+                extra_parameters[k] = v
+        row["extra_parameters"] = json.dumps(extra_parameters, default=str)
+        return row
+
+    def add_row(self, result):
+        with self.lock:
+            self.rows.append(self._to_row(result))
+            if len(self.rows) < self.batch_size:
+                return
+        self.flush()
+
+    def _rotate_incompatible_file(self):
+        # files written before the fixed schema existed are kept, but not appended to
+        with self.path.open(newline="") as f:
+            header = next(csv.reader(f), None)
+        if header is None or header == RESULT_FIELDS:
+            return
+        old_path = self.path.with_name(
+            self.path.stem + "_" + str(int(time.time())) + self.path.suffix
+        )
+        os.replace(self.path, old_path)
+        log_it(
+            "Moved {} with an outdated header to {}".format(self.path, old_path)
+        )
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if len(rows) == 0:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock_path.open("a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.path.is_file():
+                    self._rotate_incompatible_file()
+                with self.path.open("a", newline="") as f:
+                    csv_writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+                    if f.tell() == 0:
+                        csv_writer.writeheader()
+                    csv_writer.writerows(rows)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
+
+def get_results_writer(path):
+    key = str(Path(path).resolve())
+    with _writers_lock:
+        writer = _writers.get(key)
+        # a forked process must not write the rows buffered by its parent again
+        if writer is None or writer.pid != os.getpid():
+            writer = ResultsWriter(path)
+            _writers[key] = writer
+        return writer
@@ -1,5 +1,7 @@
 from .boundaryPairSampling import *
 from .committeeSampling import *
+from .coreSetSampling import *
+from .densityWeightedUncertaintySampling import *
 from .randomSampling import *
 from .sheetBasedActiveLearner import *
 from .sheetBasedCommitteeSampling import *
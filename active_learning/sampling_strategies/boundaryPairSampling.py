@@ -1,58 +1,105 @@
-from pprint import pprint
+import heapq
+from itertools import chain
 
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
 
 from ..activeLearner import ActiveLearner
 
 
 class BoundaryPairSampler(ActiveLearner):
-    def append(self, indices, x, distance_dict, Y_joined):
-        if Y_joined[indices[x][0]] is Y_joined[indices[x][1]]:
-            return False  # limit to distance between different classes
-        if (indices[x][1], indices[x][0]) in distance_dict:
-            return False  # avoid double point pairs
-        return True
-
-    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices):
-        print("BoundaryPairSampler is broken. Please fix or move on.")
-        exit(-2)
-        Y_pred = self.clf_list[0].predict(self.X_train_unlabeled)
-
-        Y_joined = np.append(Y_pred, self.Y_train_labeled0)
-        X_joined = np.append(self.X_train_unlabeled, self.X_train_labeled0)
-        index_joined = np.indices(X_joined)
-
-        nbrs = NearestNeighbors(
-            n_neighbors=2, algorithm="ball_tree", n_jobs=self.config.cores
-        ).fit(X_joined)
-        distances, indices = nbrs.kneighbors(X_joined)
-
-        distance_dict = {}
-
-        for x in range(len(distances)):
-            if self.append(indices, x, distance_dict, Y_joined) is True:
-                distance_dict[(indices[x][0], indices[x][1])] = distances[x][1]
-
-        myset = []
-
-        while len(myset) < self.nr_queries_per_iteration:
-            if len(distance_dict.keys()) == 0:
-                pprint(distances)
-                pprint(indices)
-
-            # somehow distance_dict is empty?!
-            index_pair = min(distance_dict, key=distance_dict.get)
-
-            if index_pair[0] < len(self.X_train_unlabeled):
-                true_index = index_joined[index_pair[0]]
-                myset.append(true_index)
-
-            if index_pair[1] < len(self.X_train_unlabeled):
-                true_index = index_joined[index_pair[1]]
-                myset.append(true_index)
-
-            # myset = np.unique(myset)
-            del distance_dict[index_pair]
-
-        return myset
+    # amount of neighbors per sample in which a partner with a different label is searched for
+    N_NEIGHBORS = 10
+
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        # the neighbor index is computed only once for the whole pool and reused in every iteration
+        distances, neighbors = self.data_storage.get_neighbor_index(
+            self.N_NEIGHBORS, self.N_JOBS
+        ).kneighbors()
+
+        # labels for the whole pool: the known labels for the labeled part, predictions for the rest
+        pool_labels = np.empty(len(self.data_storage.pool_index), dtype=int)
+        pool_labels[
+            self.data_storage.get_pool_positions(self.data_storage.Y_train_labeled.index)
+        ] = self.data_storage.Y_train_labeled[0].to_numpy()
+        pool_labels[
+            self.data_storage.get_pool_positions(self.data_storage.X_train_unlabeled.index)
+        ] = self.clf.predict(self.data_storage.X_train_unlabeled)
+
+        # only samples from the clusters handed over can be queried
+        candidate_mask = np.zeros(len(self.data_storage.pool_index), dtype=bool)
+        candidate_mask[
+            self.data_storage.get_pool_positions(
+                chain(*X_train_unlabeled_cluster_indices.values())
+            )
+        ] = True
+
+        # all neighbor pairs with different labels which contain at least one queryable sample
+        pair_a = np.repeat(np.arange(len(pool_labels)), neighbors.shape[1])
+        pair_b = neighbors.ravel()
+        pair_distances = distances.ravel()
+
+        boundary_mask = (pool_labels[pair_a] != pool_labels[pair_b]) & (
+            candidate_mask[pair_a] | candidate_mask[pair_b]
+        )
+        pair_a, pair_b = np.minimum(pair_a, pair_b), np.maximum(pair_a, pair_b)
+        pair_a = pair_a[boundary_mask]
+        pair_b = pair_b[boundary_mask]
+        pair_distances = pair_distances[boundary_mask]
+
+        # avoid double point pairs
+        _, unique_pairs = np.unique(
+            pair_a.astype(np.int64) * len(pool_labels) + pair_b, return_index=True
+        )
+        pair_a = pair_a[unique_pairs]
+        pair_b = pair_b[unique_pairs]
+        pair_distances = pair_distances[unique_pairs]
+
+        # every pair contributes at least one query, so twice the amount of queries is enough in most cases
+        query_positions = []
+        amount_of_pairs = min(2 * self.nr_queries_per_iteration, len(pair_distances))
+        while len(query_positions) < self.nr_queries_per_iteration:
+            if amount_of_pairs < len(pair_distances):
+                closest_pairs = np.argpartition(pair_distances, amount_of_pairs)[
+                    :amount_of_pairs
+                ]
+            else:
+                closest_pairs = np.arange(len(pair_distances))
+
+            heap = list(
+                zip(
+                    pair_distances[closest_pairs],
+                    pair_a[closest_pairs],
+                    pair_b[closest_pairs],
+                )
+            )
+            heapq.heapify(heap)
+
+            query_positions = []
+            queried = set()
+            while heap and len(query_positions) < self.nr_queries_per_iteration:
+                _, a, b = heapq.heappop(heap)
+                for position in (a, b):
+                    if candidate_mask[position] and position not in queried:
+                        queried.add(position)
+                        query_positions.append(position)
+
+            if amount_of_pairs >= len(pair_distances):
+                break
+            amount_of_pairs = min(2 * amount_of_pairs, len(pair_distances))
+
+        query_positions = query_positions[: self.nr_queries_per_iteration]
+
+        # not enough boundary pairs (e.g. everything is predicted as the same class) -> fill up randomly
+        if len(query_positions) < self.nr_queries_per_iteration:
+            candidate_mask[query_positions] = False
+            remaining_positions = np.flatnonzero(candidate_mask)
+            query_positions += self.data_storage.rng.choice(
+                remaining_positions,
+                size=min(
+                    self.nr_queries_per_iteration - len(query_positions),
+                    len(remaining_positions),
+                ),
+                replace=False,
+            ).tolist()
+
+        return self.data_storage.pool_index[query_positions].tolist()
@@ -0,0 +1,108 @@
+from itertools import chain
+
+import numpy as np
+from scipy.stats import entropy
+from sklearn.metrics import pairwise_distances_chunked
+from sklearn.metrics.pairwise import euclidean_distances
+
+from ..activeLearner import ActiveLearner
+
+
+class CoreSetSampler(ActiveLearner):
+    # upper bound in MB for the temporary distance matrices
+    WORKING_MEMORY = 256
+
+    strategy = None
+    min_distances = None
+
+    def set_uncertainty_strategy(self, strategy):
+        # None -> pure k-center greedy, otherwise the distances get weighted by the uncertainty
+        self.strategy = strategy
+
+    def _update_min_distances(self):
+        # only the rows which got labeled since the last call are taken into account
+        new_labeled_indices = self.data_storage.Y_train_labeled.index[
+            self.amount_of_processed_labels :
+        ]
+        self.amount_of_processed_labels = len(self.data_storage.Y_train_labeled)
+
+        if len(new_labeled_indices) == 0:
+            return
+
+        X_new_labeled = self.X_pool[
+            self.data_storage.get_pool_positions(new_labeled_indices)
+        ]
+
+        start = 0
+        for min_distances_chunk in pairwise_distances_chunked(
+            self.X_pool,
+            X_new_labeled,
+            reduce_func=lambda D_chunk, _: D_chunk.min(axis=1),
+            n_jobs=self.N_JOBS,
+            working_memory=self.WORKING_MEMORY,
+        ):
+            end = start + len(min_distances_chunk)
+            np.minimum(
+                self.min_distances[start:end],
+                min_distances_chunk,
+                out=self.min_distances[start:end],
+            )
+            start = end
+
+    def _calculate_uncertainties(self, candidate_positions):
+        # the classifier is trained on the original features, not the reduced ones
+        Y_temp_proba = self.clf.predict_proba(
+            self.data_storage.X_train_pool.iloc[candidate_positions]
+        )
+
+        if self.strategy == "least_confident":
+            result = 1 - np.amax(Y_temp_proba, axis=1)
+        elif self.strategy == "max_margin":
+            margin = np.partition(-Y_temp_proba, 1, axis=1)
+            result = 1 - np.abs(margin[:, 0] - margin[:, 1])
+        elif self.strategy == "entropy":
+            result = np.apply_along_axis(entropy, 1, Y_temp_proba)
+        return result
+
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        if self.min_distances is None:
+            self.X_pool = self.data_storage.get_X_train_pool_reduced()
+            self.min_distances = np.full(len(self.X_pool), np.inf)
+            self.amount_of_processed_labels = 0
+
+        self._update_min_distances()
+
+        candidate_positions = self.data_storage.get_pool_positions(
+            chain(*X_train_unlabeled_cluster_indices.values())
+        )
+
+        # distances of the candidates to the labeled set plus the samples selected for this batch
+        candidate_min_distances = self.min_distances[candidate_positions].copy()
+
+        if self.strategy is not None:
+            weights = self._calculate_uncertainties(candidate_positions)
+        else:
+            weights = np.ones(len(candidate_positions))
+
+        X_candidates = self.X_pool[candidate_positions]
+        already_selected = np.zeros(len(candidate_positions), dtype=bool)
+
+        query_positions = []
+        for _ in range(min(self.nr_queries_per_iteration, len(candidate_positions))):
+            scores = candidate_min_distances * weights
+            # never select the same sample twice
+            scores[already_selected] = -np.inf
+
+            selected = np.argmax(scores)
+            already_selected[selected] = True
+            query_positions.append(candidate_positions[selected])
+
+            np.minimum(
+                candidate_min_distances,
+                euclidean_distances(
+                    X_candidates, X_candidates[selected].reshape(1, -1)
+                ).ravel(),
+                out=candidate_min_distances,
+            )
+
+        return self.data_storage.pool_index[query_positions].tolist()
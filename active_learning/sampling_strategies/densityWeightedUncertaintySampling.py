@@ -0,0 +1,32 @@
+from itertools import chain
+
+import numpy as np
+
+from .uncertaintySampling import UncertaintySampler
+
+
+class DensityWeightedUncertaintySampler(UncertaintySampler):
+    # neighbors used for the density estimation and the influence of the density
+    N_NEIGHBORS = 10
+    DENSITY_EXPONENT = 1
+
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        X_train_unlabeled_indices = list(
+            chain(*list(X_train_unlabeled_cluster_indices.values()))
+        )
+        result = self.calculate_uncertainties(X_train_unlabeled_indices)
+
+        # densities are computed only once per dataset, here they are just looked up
+        densities = self.data_storage.get_pool_densities(self.N_NEIGHBORS, self.N_JOBS)
+        result = (
+            result
+            * densities[
+                self.data_storage.get_pool_positions(X_train_unlabeled_indices)
+            ]
+            ** self.DENSITY_EXPONENT
+        )
+
+        argsort = np.argsort(-result)
+        query_indices = np.array(X_train_unlabeled_indices)[argsort]
+
+        return query_indices[: self.nr_queries_per_iteration]
@@ -1,18 +1,22 @@
-import random
-
 from ..activeLearner import ActiveLearner
+from ..dataStorage import IndexPool
 
 
 class RandomSampler(ActiveLearner):
-    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices):
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
         # we only take the first cluster into consideration and take a random sample from it, could be extended to work with multiple clusters as well
-        random_cluster = X_train_unlabeled_cluster_indices[
-            list(X_train_unlabeled_cluster_indices.keys())[0]
-        ]
+        random_cluster = next(iter(X_train_unlabeled_cluster_indices.values()))
 
         size_of_random_sample = self.nr_queries_per_iteration
         length_X_train_unlabled = len(random_cluster)
         if size_of_random_sample > length_X_train_unlabled:
             size_of_random_sample = length_X_train_unlabled
 
-        return random.sample(random_cluster, size_of_random_sample)
+        if isinstance(random_cluster, IndexPool):
+            return random_cluster.sample(size_of_random_sample, self.data_storage.rng)
+        elif size_of_random_sample == length_X_train_unlabled:
+            # the cluster strategy already did the random sampling for us
+            return list(random_cluster)
+        return self.data_storage.rng.choice(
+            random_cluster, size=size_of_random_sample, replace=False
+        ).tolist()
@@ -1,20 +1,42 @@
+from itertools import chain
+
 import numpy as np
 
 from ..activeLearner import ActiveLearner
 
 
 class SheetBasedActiveLearner(ActiveLearner):
+    """Queries all remaining unlabeled rows of one group (e.g. a spreadsheet) at once
+
+    The groups have to be set using DataStorage.set_pool_groups.
+    """
+
     current_sheet_name = None
 
-    def __init__(self, config):
-        super(SheetBasedActiveLearner, self).__init__(config)
+    def __init__(self, *args, **kwargs):
+        super(SheetBasedActiveLearner, self).__init__(*args, **kwargs)
+        self.metrics_per_al_cycle["queried_sheet"] = []
 
-    def move_new_queries_to_training_data(self, query_indices):
-        print("Queried sheet " + self.current_sheet_name)
-        self.metrics_per_al_cycle["queried_sheet"].append(self.current_sheet_name)
-        super(SheetBasedActiveLearner, self).move_new_queries_to_training_data(
-            query_indices
-        )
-        self.X_query_spreadsheets = np.delete(
-            self.X_query_spreadsheets, query_indices, 0
+    def get_candidate_positions(self, X_train_unlabeled_cluster_indices):
+        return self.data_storage.get_pool_positions(
+            chain(*X_train_unlabeled_cluster_indices.values())
         )
+
+    def calculate_group_mean_scores(self, scores, positions):
+        # mean score per group, groups without any of the given positions get nan
+        group_ids = self.data_storage.pool_group_ids[positions]
+        minlength = len(self.data_storage.pool_group_names)
+
+        sums = np.bincount(group_ids, weights=scores, minlength=minlength)
+        counts = np.bincount(group_ids, minlength=minlength)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / counts
+
+    def get_group_query_indices(self, group_id):
+        self.current_sheet_name = self.data_storage.pool_group_names[group_id]
+        self.metrics_per_al_cycle["queried_sheet"].append(self.current_sheet_name)
+
+        return self.data_storage.pool_index[
+            self.data_storage.get_unlabeled_group_positions(group_id)
+        ].tolist()
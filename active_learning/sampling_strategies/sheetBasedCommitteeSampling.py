@@ -4,6 +4,7 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.utils.class_weight import compute_sample_weight
 
+from ..experiment_setup_lib import get_best_hyper_params
 from .sheetBasedActiveLearner import SheetBasedActiveLearner
 
 
@@ -34,81 +35,66 @@ class Committee:
 
 
 class SheetBasedCommitteeSampler(SheetBasedActiveLearner):
-    def __init__(self, config):
+    def __init__(self, *args, **kwargs):
+        super(SheetBasedCommitteeSampler, self).__init__(*args, **kwargs)
 
-        super(SheetBasedCommitteeSampler, self).__init__(config)
+        best_hyper_parameters = {"n_jobs": self.N_JOBS}
 
-        random_state = self.best_hyper_parameters["random_state"]
-        del self.best_hyper_parameters["random_state"]
+        def random_state(factor):
+            # -1 enables true randomness
+            if self.RANDOM_SEED == -1:
+                return None
+            return factor * self.RANDOM_SEED
 
         clf0 = RandomForestClassifier(
-            random_state=37264 * random_state, **self.best_hyper_parameters
+            random_state=random_state(37264), **best_hyper_parameters
         )
         clf1 = RandomForestClassifier(
-            random_state=948 * random_state, **self.best_hyper_parameters
+            random_state=random_state(948), **best_hyper_parameters
         )
-        clf2 = MultinomialNB(**functions.get_best_hyper_params("NB"))
+        clf2 = MultinomialNB(**get_best_hyper_params("NB"))
         clf3 = svm.SVC(
-            random_state=2648 * random_state,
+            random_state=random_state(2648),
             gamma="auto",
-            **functions.get_best_hyper_params("SVMPoly")
+            **get_best_hyper_params("SVMPoly")
         )
         clf4 = RandomForestClassifier(
-            random_state=382 * random_state, **self.best_hyper_parameters
+            random_state=random_state(382), **best_hyper_parameters
         )
 
         self.clf_list = [clf0, clf1, clf2, clf3, clf4]
 
         self.committee = Committee(self.clf_list)
 
-        self.metrics_per_time = {
-            "test_data": [[] for clf in self.clf_list],
-            "train_data": [[] for clf in self.clf_list],
-            "query_data": [[] for clf in self.clf_list],
-            "query_set_distribution": [[] for clf in self.clf_list],
-            "stop_certainty_list": [],
-            "stop_stddev_list": [],
-            "stop_accuracy_list": [],
-            "queried_sheet": [],
-            "queried_length": [],
-        }
-
-    def fit_clf(self,):
-        self.committee.fit(self.X_train_labeled, self.Y_train_labeled)
-
-        current_clf_list = self.committee.get_clf_list()
-
-    def setClassifierClasses(self, classes):
-        self.classifier_classes = classes
-
-    def calculate_next_query_indices(self):
-
-        committee_predictions = self.committee.predict(self.X_train_unlabeled)
-
-        len_predictions = len(committee_predictions[0])
-        count_clf = len(self.clf_list)
-        score = np.zeros(len_predictions)
-
-        for i in range(len_predictions):
-            class_count = [0] * len(self.classifier_classes)
-            for clf_i in range(count_clf):
-                ordinal = self.classifier_classes.index(committee_predictions[clf_i][i])
-                class_count[ordinal] += 1
-            score[i] = sum([c * c for c in class_count])
-
-        spreadsheet_scores = {}
-
-        # group scores by query
-        for spreadsheet, score in zip(self.X_query_spreadsheets, score):
-            if spreadsheet not in spreadsheet_scores.keys():
-                spreadsheet_scores[spreadsheet] = []
-            spreadsheet_scores[spreadsheet].append(score)
+    def fit_clf(self):
+        super(SheetBasedCommitteeSampler, self).fit_clf()
+        self.committee.fit(
+            self.data_storage.X_train_labeled, self.data_storage.Y_train_labeled[0]
+        )
 
-        for spreadsheet, scores in spreadsheet_scores.items():
-            spreadsheet_scores[spreadsheet] = np.mean(scores)
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        candidate_positions = self.get_candidate_positions(
+            X_train_unlabeled_cluster_indices
+        )
 
-        most_uncertain_spreadsheet = min(spreadsheet_scores, key=spreadsheet_scores.get)
+        committee_predictions = np.array(
+            self.committee.predict(
+                self.data_storage.X_train_unlabeled.loc[
+                    self.data_storage.pool_index[candidate_positions]
+                ]
+            )
+        )
 
-        self.current_sheet_name = most_uncertain_spreadsheet
+        # votes per sample and class, the sum of the squared votes is the lowest for the highest disagreement
+        class_count = np.stack(
+            [
+                np.count_nonzero(committee_predictions == clf_class, axis=0)
+                for clf_class in np.unique(committee_predictions)
+            ],
+            axis=1,
+        )
+        score = np.sum(class_count ** 2, axis=1)
 
-        return np.nonzero(self.X_query_spreadsheets == most_uncertain_spreadsheet)
+        group_scores = self.calculate_group_mean_scores(score, candidate_positions)
+        most_uncertain_group = np.nanargmin(group_scores)
+        return self.get_group_query_indices(most_uncertain_group)
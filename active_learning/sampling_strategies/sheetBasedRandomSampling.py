@@ -1,12 +1,18 @@
-import random
-
 import numpy as np
 
 from .sheetBasedActiveLearner import SheetBasedActiveLearner
 
 
 class SheetBasedRandomSampler(SheetBasedActiveLearner):
-    def calculate_next_query_indices(self):
-        random_sheet_name = random.choice(np.unique(self.X_query_spreadsheets))
-        self.current_sheet_name = random_sheet_name
-        return np.nonzero(self.X_query_spreadsheets == random_sheet_name)
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        candidate_positions = self.get_candidate_positions(
+            X_train_unlabeled_cluster_indices
+        )
+
+        # every group with at least one candidate has the same probability
+        counts = np.bincount(
+            self.data_storage.pool_group_ids[candidate_positions],
+            minlength=len(self.data_storage.pool_group_names),
+        )
+        random_group = self.data_storage.rng.choice(np.flatnonzero(counts))
+        return self.get_group_query_indices(random_group)
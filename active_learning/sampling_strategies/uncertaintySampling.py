@@ -13,11 +13,7 @@ class UncertaintySampler(ActiveLearner):
     def setClassifierClasses(self, classes):
         self.classifier_classes = classes
 
-    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
-        # merge indices from all clusters together and take the n most uncertain ones from them
-        X_train_unlabeled_indices = list(
-            chain(*list(X_train_unlabeled_cluster_indices.values()))
-        )
+    def calculate_uncertainties(self, X_train_unlabeled_indices):
         # recieve predictions and probabilitys
         # for all possible classifications of CLASSIFIER
         Y_temp_proba = self.clf.predict_proba(
@@ -28,9 +24,17 @@ class UncertaintySampler(ActiveLearner):
             result = 1 - np.amax(Y_temp_proba, axis=1)
         elif self.strategy == "max_margin":
             margin = np.partition(-Y_temp_proba, 1, axis=1)
-            result = -np.abs(margin[:, 0] - margin[:, 1])
+            result = 1 - np.abs(margin[:, 0] - margin[:, 1])
         elif self.strategy == "entropy":
             result = np.apply_along_axis(entropy, 1, Y_temp_proba)
+        return result
+
+    def calculate_next_query_indices(self, X_train_unlabeled_cluster_indices, *args):
+        # merge indices from all clusters together and take the n most uncertain ones from them
+        X_train_unlabeled_indices = list(
+            chain(*list(X_train_unlabeled_cluster_indices.values()))
+        )
+        result = self.calculate_uncertainties(X_train_unlabeled_indices)
 
         # sort X_train_unlabeled_indices by argsort
         argsort = np.argsort(-result)
@@ -0,0 +1,118 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .experiment_setup_lib import get_param_list_id, log_it
+
+
+class SearchCheckpoint:
+    """Makes a hyper parameter search resumable after a crash
+
+    The finished runs are indexed by (param_list_id, dataset, seed) from the
+    hyper_parameters.csv files of the output directory. The initial state of the
+    search RNG is saved as well, so that a restarted search draws the same configs
+    again and only schedules those runs which haven't finished yet. RANDOM_SEED=-2
+    seeds are derived from the config itself, so a finished config is recognized even
+    if a different NR_RANDOM_RUNS draws the configs in a different order.
+    """
+
+    def __init__(self, output_directory, random_seed):
+        self.output_directory = Path(output_directory)
+        self.state_path = self.output_directory / "hyper_search_state.pickle"
+
+        self.completed = self._load_completed()
+        self.random_state = self._load_random_state(random_seed)
+        self.seen_param_list_ids = set()
+
+        # apart from the config sampler, whose use of the RNG depends on n_iter
+        seed_random_state = np.random.RandomState()
+        seed_random_state.set_state(self.random_state.get_state())
+        self.seed_base = int(seed_random_state.randint(0, 2147483647))
+
+        log_it(
+            "Resuming hyper search with {} finished runs".format(len(self.completed))
+        )
+
+    def _load_completed(self):
+        # (param_list_id, dataset_name, random_seed) -> fit_score
+        # older results files are moved aside by the ResultsWriter, but still count
+        results_paths = sorted(self.output_directory.glob("hyper_parameters*.csv"))
+        if len(results_paths) == 0:
+            return {}
+
+        columns = ["param_list_id", "dataset_name", "random_seed", "fit_score"]
+        results = pd.concat(
+            [
+                pd.read_csv(path, usecols=columns, on_bad_lines="skip")[columns]
+                for path in results_paths
+            ]
+        )
+        results["random_seed"] = pd.to_numeric(results["random_seed"], errors="coerce")
+        results["fit_score"] = pd.to_numeric(results["fit_score"], errors="coerce")
+        results = results.dropna()
+
+        return {
+            (param_list_id, dataset_name, int(random_seed)): fit_score
+            for (
+                param_list_id,
+                dataset_name,
+                random_seed,
+                fit_score,
+            ) in results.itertuples(index=False)
+        }
+
+    def _load_random_state(self, random_seed):
+        if random_seed not in (-1, -2):
+            # a fixed seed replays the same configs anyway
+            return np.random.RandomState(random_seed)
+
+        random_state = np.random.RandomState()
+        if self.state_path.is_file():
+            with self.state_path.open("rb") as f:
+                random_state.set_state(pickle.load(f))
+        else:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+            with tmp_path.open("wb") as f:
+                pickle.dump(random_state.get_state(), f)
+            os.replace(tmp_path, self.state_path)
+        return random_state
+
+    def get_config_seed(self, hyper_parameters):
+        # the same config always gets the same seed within one (resumed) search
+        config_id = get_param_list_id(dict(hyper_parameters, RANDOM_SEED=-2))
+        return int(
+            np.random.RandomState([self.seed_base, int(config_id[:8], 16)]).randint(
+                0, 2147483647
+            )
+        )
+
+    def prepare_samples(self, hyper_parameter_samples):
+        """Skips duplicated configs and sets the RANDOM_SEED=-2 seeds
+
+        Setting the seeds here instead of inside the runs makes them reproducible, so
+        that finished runs with random seeds can be recognized as well.
+        """
+        for hyper_parameters in hyper_parameter_samples:
+            hyper_parameters = dict(hyper_parameters)
+            if hyper_parameters["RANDOM_SEED"] == -2:
+                hyper_parameters["RANDOM_SEED"] = self.get_config_seed(hyper_parameters)
+
+            param_list_id = get_param_list_id(hyper_parameters)
+            if param_list_id in self.seen_param_list_ids:
+                continue
+            self.seen_param_list_ids.add(param_list_id)
+            yield hyper_parameters
+
+    def get_fit_score(self, hyper_parameters, dataset_name):
+        # None if the run hasn't finished yet
+        return self.completed.get(
+            (
+                get_param_list_id(hyper_parameters),
+                dataset_name,
+                hyper_parameters["RANDOM_SEED"],
+            )
+        )
@@ -0,0 +1,190 @@
+import os
+import random
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+from .al_cycle_wrapper import continue_and_eval_dataset, train_and_eval_dataset
+from .experimentScheduler import _prepare_experiment
+from .experiment_setup_lib import get_param_list_id, log_it
+
+
+def _run_halving_step(
+    hyper_parameters, dataset_name, oracle_factory, checkpoint_path, governor
+):
+    # trains a new run, or continues the checkpointed one up to the new budget
+    checkpoint_path = Path(checkpoint_path)
+    start = time.time()
+
+    if checkpoint_path.is_file():
+        saved_hyper_parameters, splits, active_learner = joblib.load(checkpoint_path)
+        # the already drawn seed stays the same, only the budget is raised
+        hyper_parameters = governor.apply(
+            dict(
+                saved_hyper_parameters,
+                NR_LEARNING_ITERATIONS=hyper_parameters["NR_LEARNING_ITERATIONS"],
+            )
+        )
+        if hyper_parameters["RANDOM_SEED"] != -1:
+            seed = (
+                hyper_parameters["RANDOM_SEED"] + active_learner.current_iteration
+            ) % 2 ** 32
+            np.random.seed(seed)
+            random.seed(seed)
+
+        score, _ = continue_and_eval_dataset(
+            dataset_name, *splits, active_learner, hyper_parameters
+        )
+    else:
+        hyper_parameters, splits = _prepare_experiment(
+            hyper_parameters, dataset_name, governor
+        )
+        X_train, X_test, Y_train, Y_test, label_encoder_classes, groups = splits
+        splits = (X_train, X_test, Y_train, Y_test)
+
+        score, _, active_learner = train_and_eval_dataset(
+            dataset_name,
+            X_train,
+            X_test,
+            Y_train,
+            Y_test,
+            label_encoder_classes,
+            hyper_parameters=hyper_parameters,
+            oracle=oracle_factory(),
+            groups=groups,
+            return_active_learner=True,
+        )
+
+    # written atomically, a crashed worker never leaves a broken checkpoint behind
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint_path.with_name(
+        checkpoint_path.name + ".tmp" + str(os.getpid())
+    )
+    try:
+        joblib.dump((hyper_parameters, splits, active_learner), tmp_path)
+        os.replace(tmp_path, checkpoint_path)
+    finally:
+        if tmp_path.is_file():
+            tmp_path.unlink()
+
+    return score, time.time() - start
+
+
+class SuccessiveHalvingSearch:
+    """Successive halving over AL configs with the learning iterations as budget
+
+    All configs start with min_iterations iterations. After every rung only the best
+    1/factor configs (by their mean score over all datasets) are promoted, and their
+    budget is multiplied by factor until max_iterations is reached. Promoted runs are
+    not restarted, the active learner of every run is checkpointed and continued from
+    its last iteration.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        checkpoint_directory,
+        min_iterations=5,
+        max_iterations=100,
+        factor=3,
+    ):
+        self.scheduler = scheduler
+        self.checkpoint_directory = Path(checkpoint_directory)
+        self.min_iterations = max(1, min(min_iterations, max_iterations))
+        self.max_iterations = max_iterations
+        self.factor = max(2, factor)
+
+    def _get_checkpoint_path(self, hyper_parameters, dataset_name):
+        # named after the config, so that a restarted search continues the same runs
+        return self.checkpoint_directory / "{}_{}.joblib".format(
+            get_param_list_id(hyper_parameters), dataset_name
+        )
+
+    def _remove_checkpoints(self, configs, dataset_names):
+        for hyper_parameters in configs:
+            for dataset_name in dataset_names:
+                path = self._get_checkpoint_path(hyper_parameters, dataset_name)
+                if path.is_file():
+                    path.unlink()
+
+    def run(
+        self, hyper_parameter_samples, dataset_names, oracle_factory, checkpoint=None
+    ):
+        """Yields (hyper_parameters, dataset_name, score, run_time) for every run of every rung
+
+        hyper_parameters contains the NR_LEARNING_ITERATIONS budget of the rung. Runs
+        which have already finished according to the SearchCheckpoint are not run again.
+        """
+        configs = [
+            dict(hyper_parameters) for hyper_parameters in hyper_parameter_samples
+        ]
+        alive = list(range(len(configs)))
+        budget = self.min_iterations
+
+        while len(alive) > 0:
+            log_it(
+                "Successive halving: {} configs with {} iterations".format(
+                    len(alive), budget
+                )
+            )
+            scores = defaultdict(list)
+            config_ids = {}
+            steps = []
+            for config_id in alive:
+                for dataset_name in dataset_names:
+                    hyper_parameters = self.scheduler.governor.apply(
+                        dict(configs[config_id], NR_LEARNING_ITERATIONS=budget)
+                    )
+                    if checkpoint is not None:
+                        score = checkpoint.get_fit_score(hyper_parameters, dataset_name)
+                        if score is not None:
+                            scores[config_id].append(score)
+                            yield hyper_parameters, dataset_name, score, 0
+                            continue
+
+                    checkpoint_path = str(
+                        self._get_checkpoint_path(configs[config_id], dataset_name)
+                    )
+                    config_ids[checkpoint_path] = config_id
+                    steps.append(
+                        (
+                            hyper_parameters,
+                            dataset_name,
+                            oracle_factory,
+                            checkpoint_path,
+                        )
+                    )
+
+            for (
+                (hyper_parameters, dataset_name, _, checkpoint_path),
+                (score, run_time),
+            ) in self.scheduler.map_unordered(_run_halving_step, steps):
+                scores[config_ids[checkpoint_path]].append(score)
+                yield hyper_parameters, dataset_name, score, run_time
+
+            # configs with a failed run are never promoted
+            mean_scores = {
+                config_id: np.mean(scores[config_id])
+                for config_id in alive
+                if len(scores[config_id]) == len(dataset_names)
+            }
+            ranking = sorted(mean_scores, key=mean_scores.get, reverse=True)
+
+            if budget >= self.max_iterations:
+                promoted = []
+            else:
+                promoted = ranking[: max(1, len(alive) // self.factor)]
+                budget = min(budget * self.factor, self.max_iterations)
+
+            self._remove_checkpoints(
+                [
+                    configs[config_id]
+                    for config_id in alive
+                    if config_id not in promoted
+                ],
+                dataset_names,
+            )
+            alive = promoted
@@ -1,4 +1,6 @@
 from .weakClust import *
 from .weakCert import *
 from .snubaLite import *
+from .labelModel import *
+from .weakSpread import *
 from .baseWeakSupervision import *
@@ -1,4 +1,5 @@
 import abc
+from concurrent.futures import ThreadPoolExecutor
 
 
 class BaseWeakSupervision:
@@ -10,4 +11,28 @@ class BaseWeakSupervision:
 
     @abc.abstractmethod
     def get_labeled_samples(self, **kwargs):
+        # all sources run every time, so this must not change any state which decides
+        # what later calls return, such changes are applied in commit_labeled_samples
         pass
+
+    def commit_labeled_samples(self):
+        # called for every source which the priority order would have asked: all sources
+        # up to and including the one whose result is used
+        pass
+
+
+def get_all_labeled_samples(label_sources):
+    """runs all weak supervision sources concurrently, the results keep the order of label_sources
+
+    the sources are numpy/sklearn bound and release the GIL most of the time, so this takes
+    roughly as long as the slowest source instead of the sum of all of them
+    """
+    if len(label_sources) <= 1:
+        return [label_source.get_labeled_samples() for label_source in label_sources]
+
+    with ThreadPoolExecutor(max_workers=len(label_sources)) as executor:
+        return list(
+            executor.map(
+                lambda label_source: label_source.get_labeled_samples(), label_sources
+            )
+        )
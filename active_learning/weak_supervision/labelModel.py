@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ..experiment_setup_lib import log_it
+from .baseWeakSupervision import BaseWeakSupervision, get_all_labeled_samples
+
+
+class LabelModel(BaseWeakSupervision):
+    """Combines the votes of all weak supervision sources instead of taking the first one
+
+    The votes are stored in a sparse (samples x sources * classes) one-hot matrix, the
+    accuracy of every source is estimated with the EM algorithm of a one-coin
+    Dawid-Skene model. The estimates are anchored on the votes a source gave for samples
+    which have got a strong (G/A) label since. Only samples whose aggregated label is
+    certain enough are returned, and a single vote only counts for a source with enough
+    strong labels to check it against.
+    """
+
+    # threshold params
+    MINIMUM_CONFIDENCE = None
+    INITIAL_ACCURACY = 0.7
+    PRIOR_STRENGTH = 1
+    EM_ITERATIONS = 50
+    EM_TOLERANCE = 1e-4
+    # strong labels a source needs to be trusted without a second vote
+    MINIMUM_ANCHOR_VOTES = 10
+
+    def __init__(self, data_storage, label_sources, **THRESHOLDS):
+        super(LabelModel, self).__init__(data_storage, **THRESHOLDS)
+        self.label_sources = label_sources
+        # latest vote of every source for every pool position, -1 if it never voted
+        self.vote_history = None
+        self.source_results = None
+
+    def update_vote_history(self, source_results):
+        for source_id, (X_weak, Y_weak, weak_indices, _) in enumerate(source_results):
+            if X_weak is None:
+                continue
+            self.vote_history[
+                source_id, self.data_storage.get_pool_positions(Y_weak.index)
+            ] = Y_weak[0].to_numpy()
+
+    def get_anchor_votes(self):
+        # correct and all votes of every source on samples which now have a strong label
+        Y_train_labeled = self.data_storage.Y_train_labeled
+        strong_labels = Y_train_labeled[Y_train_labeled.source.isin(["G", "A"])]
+        strong_positions = self.data_storage.get_pool_positions(strong_labels.index)
+
+        past_votes = self.vote_history[:, strong_positions]
+        voted = past_votes >= 0
+        correct = voted & (past_votes == strong_labels[0].to_numpy()[np.newaxis])
+        return correct.sum(axis=1), voted.sum(axis=1)
+
+    def collect_votes(self, source_results):
+        n_pool = len(self.data_storage.pool_index)
+        n_classes = len(self.data_storage.label_encoder.classes_)
+
+        rows = []
+        columns = []
+        for source_id, (X_weak, Y_weak, weak_indices, _) in enumerate(source_results):
+            if X_weak is None:
+                continue
+            rows.append(self.data_storage.get_pool_positions(Y_weak.index))
+            columns.append(source_id * n_classes + Y_weak[0].to_numpy())
+
+        if len(rows) == 0:
+            return None
+
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(n_pool, len(source_results) * n_classes),
+        )
+
+    def estimate(self, votes, n_sources, n_classes, anchor_correct, anchor_votes):
+        # one column per source which is 1 if the source voted for the sample
+        has_votes = votes @ sparse.kron(
+            sparse.identity(n_sources), np.ones((n_classes, 1)), format="csr"
+        )
+
+        # the accuracy of a source can only be estimated on samples where other sources voted as well
+        overlapping = np.asarray(has_votes.sum(axis=1)).ravel() >= 2
+        overlapping_votes = votes[overlapping]
+        amount_of_votes = np.asarray(has_votes[overlapping].sum(axis=0)).ravel()
+
+        accuracies = (anchor_correct + self.PRIOR_STRENGTH * self.INITIAL_ACCURACY) / (
+            anchor_votes + self.PRIOR_STRENGTH
+        )
+        priors = np.full(n_classes, 1 / n_classes)
+
+        for _ in range(self.EM_ITERATIONS):
+            # E-step: log likelihood of every class given the votes
+            clipped = np.clip(accuracies, 1e-6, 1 - 1e-6)
+            log_correct = np.log(clipped)
+            log_wrong = np.log((1 - clipped) / max(n_classes - 1, 1))
+
+            # a vote adds log_wrong to every class and additionally log_correct - log_wrong to the voted class
+            vote_weights = (
+                (log_correct - log_wrong)[:, np.newaxis, np.newaxis]
+                * np.eye(n_classes)[np.newaxis]
+            ).reshape(n_sources * n_classes, n_classes)
+
+            logits = (
+                has_votes @ log_wrong[:, np.newaxis]
+                + votes @ vote_weights
+                + np.log(priors)
+            )
+            logits -= logits.max(axis=1, keepdims=True)
+            posteriors = np.exp(logits)
+            posteriors /= posteriors.sum(axis=1, keepdims=True)
+
+            # M-step: expected amount of correct votes per source together with the
+            # votes checked against strong labels, smoothed towards the initial accuracy
+            agreements = np.asarray(
+                overlapping_votes.T @ posteriors[overlapping]
+            ).reshape(n_sources, n_classes, n_classes)
+            new_accuracies = (
+                np.einsum("jcc->j", agreements)
+                + anchor_correct
+                + self.PRIOR_STRENGTH * self.INITIAL_ACCURACY
+            ) / (amount_of_votes + anchor_votes + self.PRIOR_STRENGTH)
+            priors = np.maximum(posteriors.mean(axis=0), 1e-6)
+            priors /= priors.sum()
+
+            converged = np.max(np.abs(new_accuracies - accuracies)) < self.EM_TOLERANCE
+            accuracies = new_accuracies
+            if converged:
+                break
+
+        return posteriors, accuracies
+
+    def get_labeled_samples(self):
+        X_weak = Y_weak = weak_indices = None
+
+        source_results = self.source_results = get_all_labeled_samples(
+            self.label_sources
+        )
+        if self.vote_history is None:
+            self.vote_history = np.full(
+                (len(self.label_sources), len(self.data_storage.pool_index)), -1
+            )
+
+        votes = self.collect_votes(source_results)
+        if votes is None:
+            return X_weak, Y_weak, weak_indices, "L"
+
+        n_sources = len(self.label_sources)
+        n_classes = len(self.data_storage.label_encoder.classes_)
+        anchor_correct, anchor_votes = self.get_anchor_votes()
+
+        # only samples with at least one vote take part in the estimation
+        voted_positions = np.flatnonzero(votes.getnnz(axis=1))
+        votes = votes[voted_positions]
+        posteriors, accuracies = self.estimate(
+            votes, n_sources, n_classes, anchor_correct, anchor_votes
+        )
+        log_it(
+            "Estimated weak source accuracies: "
+            + str(accuracies)
+            + " with strong label votes "
+            + str(anchor_votes)
+        )
+
+        # a single vote of a source which couldn't be checked yet is not enough
+        has_votes = (
+            votes
+            @ sparse.kron(
+                sparse.identity(n_sources), np.ones((n_classes, 1)), format="csr"
+            )
+        ).toarray() > 0
+        trusted_sources = anchor_votes >= self.MINIMUM_ANCHOR_VOTES
+        enough_votes = (has_votes.sum(axis=1) >= 2) | np.any(
+            has_votes & trusted_sources[np.newaxis], axis=1
+        )
+
+        confidences = posteriors.max(axis=1)
+        certain = enough_votes & (confidences > self.MINIMUM_CONFIDENCE)
+
+        if np.any(certain):
+            weak_indices = self.data_storage.pool_index[
+                voted_positions[certain]
+            ].tolist()
+            X_weak = self.data_storage.X_train_unlabeled.loc[weak_indices]
+            Y_weak = pd.DataFrame(
+                posteriors[certain].argmax(axis=1), index=X_weak.index
+            )
+            log_it(
+                "Label model: {} samples with a mean confidence of {:.3f}".format(
+                    len(weak_indices), confidences[certain].mean()
+                )
+            )
+
+        return X_weak, Y_weak, weak_indices, "L"
+
+    def commit_labeled_samples(self):
+        # all sources have been asked, the current votes only count as past votes from
+        # now on, the anchors never look at votes for still unlabeled samples anyway
+        self.update_vote_history(self.source_results)
+        for label_source in self.label_sources:
+            label_source.commit_labeled_samples()
@@ -1,89 +1,150 @@
-import itertools
-import collections
-import random
+import copy
+
 import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
 
-from ..activeLearner import ActiveLearner
-from sklearn.model_selection import train_test_split
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.metrics import accuracy_score
 from .baseWeakSupervision import BaseWeakSupervision
 
 
 class SnubaLite(BaseWeakSupervision):
+    # threshold param
+    MINIMUM_HEURISTIC_ACCURACY = None
+    N_JOBS = 1
+
+    rng_state = None
+
+    def _fit_heuristics(self, clf_class, X_sorted, Y_sorted, X_test, Y_test):
+        """one-vs-rest threshold stumps for all features at once
+
+        For every feature and every possible split of the sorted values the amount of
+        correctly classified samples is derived from cumulative counts, the best stump per
+        feature is then evaluated on the test split. Returns the best stump over all features.
+        """
+        n_train, n_features = X_sorted.shape
+
+        positives = Y_sorted == clf_class
+        amount_of_positives = np.count_nonzero(positives[:, 0])
+
+        # split k puts the first k + 1 sorted samples on the left side of the threshold
+        left_positives = np.cumsum(positives, axis=0)[:-1]
+        left_sizes = np.arange(1, n_train)[:, np.newaxis]
+        left_negatives = left_sizes - left_positives
+        right_positives = amount_of_positives - left_positives
+        right_sizes = n_train - left_sizes
+        right_negatives = right_sizes - right_positives
+
+        # side 0: clf_class is left of the threshold, side 1: clf_class is right of it
+        accuracies = (
+            np.stack(
+                [left_positives + right_negatives, left_negatives + right_positives]
+            )
+            / n_train
+        )
+        # a threshold between two equal values is not possible
+        valid_splits = X_sorted[:-1] < X_sorted[1:]
+        accuracies[:, ~valid_splits] = -1
+
+        best_stumps = np.argmax(accuracies.reshape(-1, n_features), axis=0)
+        sides, splits = np.divmod(best_stumps, n_train - 1)
+        features = np.arange(n_features)
+        thresholds = (X_sorted[splits, features] + X_sorted[splits + 1, features]) / 2
+
+        predictions = np.where(sides == 0, X_test <= thresholds, X_test > thresholds)
+        test_accuracies = np.mean(
+            predictions == (Y_test == clf_class)[:, np.newaxis], axis=0
+        )
+        test_accuracies[~valid_splits.any(axis=0)] = -1
+
+        feature = np.argmax(test_accuracies)
+        side = sides[feature]
+        split = splits[feature]
+
+        # how pure the clf_class side of the stump is on the training data
+        if side == 0:
+            precision = left_positives[split, feature] / left_sizes[split, 0]
+        else:
+            precision = right_positives[split, feature] / right_sizes[split, 0]
+
+        return (
+            test_accuracies[feature],
+            clf_class,
+            feature,
+            thresholds[feature],
+            side,
+            precision,
+        )
+
     def get_labeled_samples(self):
         X_weak = Y_weak = weak_indices = None
-        # @todo prevent snuba_lite from relearning based on itself (so only "strong" labels are being used for weak labeling)
-        # for each label and each feature (or feature combination) generate small shallow decision tree -> is it a good idea to limit the amount of used features?!
-        highest_accuracy = 0
-        best_heuristic = None
-        best_combination = None
-        best_class = None
-
-        combinations = []
-        for combination in itertools.combinations(
-            list(range(self.data_storage.X_train_labeled.shape[1])), 1
-        ):
-            combinations.append(combination)
 
-        # generated heuristics should only being applied to small subset (which one?)
-        # balance jaccard and f1_measure (coverage + accuracy)
-        for clf_class in self.data_storage.label_encoder.classes_:
-            for combination in combinations:
-                # create training and test data set out of current available training/test data
-                X_temp = self.data_storage.X_train_labeled.loc[:, combination]
-
-                # do one vs rest
-                Y_temp = self.data_storage.Y_train_labeled.copy()
-                Y_temp = Y_temp.replace(
-                    self.data_storage.label_encoder.transform(
-                        [
-                            c
-                            for c in self.data_storage.label_encoder.classes_
-                            if c != clf_class
-                        ]
-                    ),
-                    -1,
-                )
+        # only strong labels are being used, so that snuba_lite doesn't relearn based on itself
+        Y_strong = self.data_storage.Y_train_labeled[
+            self.data_storage.Y_train_labeled["source"].isin(["G", "A"])
+        ]
+        X_strong = self.data_storage.X_train_labeled.loc[Y_strong.index].to_numpy()
+        Y_strong = Y_strong[0].to_numpy()
 
-                X_temp_train, X_temp_test, Y_temp_train, Y_temp_test = train_test_split(
-                    X_temp, Y_temp, train_size=0.6
-                )
+        # create training and test data set out of current available training/test data
+        # drawn from a copy, the rng only advances if this source is asked
+        rng = copy.deepcopy(self.data_storage.rng)
+        permutation = rng.permutation(len(Y_strong))
+        self.rng_state = rng.bit_generator.state
+        amount_of_train = int(len(Y_strong) * 0.6)
+        if amount_of_train < 2 or amount_of_train == len(Y_strong):
+            return X_weak, Y_weak, weak_indices, "S"
 
-                heuristic = DecisionTreeClassifier(max_depth=2)
-                heuristic.fit(X_temp_train, Y_temp_train)
+        train, test = permutation[:amount_of_train], permutation[amount_of_train:]
 
-                accuracy = accuracy_score(Y_temp_test, heuristic.predict(X_temp_test))
-                if accuracy > highest_accuracy:
-                    highest_accuracy = accuracy
-                    best_heuristic = heuristic
-                    best_combination = combination
-                    best_class = clf_class
+        # every feature is sorted only once and shared by all classes
+        order = np.argsort(X_strong[train], axis=0, kind="stable")
+        X_sorted = np.take_along_axis(X_strong[train], order, axis=0)
+        Y_sorted = Y_strong[train][order]
 
-        # if accuracy of decision tree is high enough -> take recommendation
-        if highest_accuracy > self.MINIMUM_HEURISTIC_ACCURACY:
-            probabilities = best_heuristic.predict_proba(
-                self.data_storage.X_train_unlabeled.loc[:, best_combination].to_numpy()
+        # generated heuristics should only being applied to small subset (which one?)
+        # balance jaccard and f1_measure (coverage + accuracy)
+        heuristics = Parallel(n_jobs=self.N_JOBS, prefer="threads")(
+            delayed(self._fit_heuristics)(
+                clf_class, X_sorted, Y_sorted, X_strong[test], Y_strong[test]
             )
+            for clf_class in np.unique(Y_strong[train])
+        )
+        (
+            highest_accuracy,
+            best_class,
+            best_feature,
+            threshold,
+            side,
+            precision,
+        ) = max(heuristics, key=lambda heuristic: heuristic[0])
 
-            # filter out labels where one-vs-rest heuristic is sure that sample is of label L
-            weak_indices = [
-                index
-                for index, proba in zip(
-                    self.data_storage.X_train_unlabeled.index, probabilities
-                )
-                if np.max(proba) > self.MINIMUM_HEURISTIC_ACCURACY
-            ]
+        # if accuracy of the heuristic is high enough -> take recommendation
+        if (
+            highest_accuracy > self.MINIMUM_HEURISTIC_ACCURACY
+            and precision > self.MINIMUM_HEURISTIC_ACCURACY
+        ):
+            X_unlabeled_feature = self.data_storage.X_train_unlabeled.iloc[
+                :, best_feature
+            ].to_numpy()
 
-            if len(weak_indices) > 0:
-                #  log_it("Snuba mit Klasse " + best_class)
-                #  log_it(weak_indices)
-                X_weak = self.data_storage.X_train_unlabeled.loc[weak_indices]
-                best_class_encoded = self.data_storage.label_encoder.transform(
-                    [best_class]
-                )[0]
-                Y_weak = [best_class_encoded for _ in weak_indices]
+            # filter out samples where the one-vs-rest heuristic is sure that they are of the label best_class
+            if side == 0:
+                weak_mask = X_unlabeled_feature <= threshold
             else:
-                weak_indices = None
+                weak_mask = X_unlabeled_feature > threshold
+
+            if np.any(weak_mask):
+                weak_indices = self.data_storage.X_train_unlabeled.index[
+                    weak_mask
+                ].tolist()
+                X_weak = self.data_storage.X_train_unlabeled.loc[weak_indices]
+                Y_weak = pd.DataFrame(
+                    [best_class for _ in weak_indices], index=X_weak.index
+                )
 
         return X_weak, Y_weak, weak_indices, "S"
+
+    def commit_labeled_samples(self):
+        if self.rng_state is not None:
+            self.data_storage.rng.bit_generator.state = self.rng_state
+            self.rng_state = None
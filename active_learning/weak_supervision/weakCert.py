@@ -3,7 +3,6 @@ import collections
 import random
 import pandas as pd
 
-from ..activeLearner import ActiveLearner
 from .baseWeakSupervision import BaseWeakSupervision
 
 
@@ -1,57 +1,144 @@
 import collections
+import heapq
 import random
+
+import numpy as np
 import pandas as pd
-from ..activeLearner import ActiveLearner
+
 from .baseWeakSupervision import BaseWeakSupervision
 
 
 class WeakClust(BaseWeakSupervision):
     # threshold params
     MINIMUM_CLUSTER_UNITY_SIZE = MINIMUM_RATIO_LABELED_UNLABELED = None
+    # how many times the cluster granularity gets halved if no cluster is found on the current one
+    COARSER_LEVELS = 0
+
+    propagatable_clusters = None
+    proposed_cluster_id = None
+
+    def _get_priority(self, cluster_id):
+        # None if the most prominent label of the cluster can't be propagated to the rest of it (yet)
+        if cluster_id not in self.data_storage.X_train_unlabeled_cluster_indices:
+            return None
+
+        label_counts = self.data_storage.cluster_label_counts[cluster_id]
+        amount_of_labeled = label_counts.sum()
+
+        if (
+            amount_of_labeled
+            / len(self.data_storage.X_train_unlabeled_cluster_indices[cluster_id])
+            <= self.MINIMUM_CLUSTER_UNITY_SIZE
+        ):
+            return None
+        if label_counts.max() <= amount_of_labeled * self.MINIMUM_RATIO_LABELED_UNLABELED:
+            return None
+
+        # purest clusters first
+        return -label_counts.max() / amount_of_labeled
+
+    def _get_propagatable_cluster(self):
+        if self.propagatable_clusters is None:
+            self.propagatable_clusters = []
+
+        # only the clusters which changed since the last call need to be looked at again
+        for cluster_id in self.data_storage.changed_clusters:
+            priority = self._get_priority(cluster_id)
+            if priority is not None:
+                heapq.heappush(self.propagatable_clusters, (priority, cluster_id))
+        self.data_storage.changed_clusters.clear()
+
+        # outdated heap entries are dropped lazily, the valid one stays until it is used
+        while self.propagatable_clusters:
+            priority, cluster_id = self.propagatable_clusters[0]
+            if self._get_priority(cluster_id) == priority:
+                return cluster_id
+            heapq.heappop(self.propagatable_clusters)
+        return None
+
+    def _get_coarser_cluster(self):
+        # same criteria as below, but evaluated vectorized for all clusters of a coarser cut of the cluster tree
+        n_classes = len(self.data_storage.label_encoder.classes_)
+        unlabeled_mask = self.data_storage.pool_unlabeled_mask
+        labeled_mask = ~unlabeled_mask
+        n_clusters = self.data_storage.n_clusters
+
+        for _ in range(self.COARSER_LEVELS):
+            n_clusters = n_clusters // 2
+            if n_clusters < 1:
+                break
+
+            _, cluster_ids = np.unique(
+                self.data_storage.cluster_tree.get_cluster_ids(n_clusters),
+                return_inverse=True,
+            )
+            amount_of_labeled = np.bincount(
+                cluster_ids[labeled_mask], minlength=n_clusters
+            )
+            amount_of_unlabeled = np.bincount(
+                cluster_ids[unlabeled_mask], minlength=n_clusters
+            )
+            label_frequencies = np.bincount(
+                cluster_ids[labeled_mask] * n_classes
+                + self.data_storage.pool_labels[labeled_mask],
+                minlength=n_clusters * n_classes,
+            ).reshape(n_clusters, n_classes)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                propagatable = (
+                    (amount_of_unlabeled > 0)
+                    & (
+                        amount_of_labeled / amount_of_unlabeled
+                        > self.MINIMUM_CLUSTER_UNITY_SIZE
+                    )
+                    & (
+                        label_frequencies.max(axis=1)
+                        > amount_of_labeled * self.MINIMUM_RATIO_LABELED_UNLABELED
+                    )
+                )
+
+            if propagatable.any():
+                cluster_id = np.flatnonzero(propagatable)[0]
+                certain_indices = self.data_storage.pool_index[
+                    (cluster_ids == cluster_id) & unlabeled_mask
+                ].tolist()
+                return certain_indices, label_frequencies[cluster_id].argmax()
+        return None, None
 
     def get_labeled_samples(self):
         certain_X = recommended_labels = certain_indices = None
-        cluster_found = False
 
         # check if the most prominent label for one cluster can be propagated over to the rest of it's cluster
-        for (
-            cluster_id,
-            cluster_indices,
-        ) in self.data_storage.X_train_labeled_cluster_indices.items():
-            if (
-                cluster_id
-                not in self.data_storage.X_train_unlabeled_cluster_indices.keys()
-            ):
-                continue
-            if (
-                len(cluster_indices)
-                / len(self.data_storage.X_train_unlabeled_cluster_indices[cluster_id])
-                > self.MINIMUM_CLUSTER_UNITY_SIZE
-            ):
-                frequencies = collections.Counter(
-                    self.data_storage.Y_train_labeled.loc[cluster_indices][0].tolist()
+        cluster_id = self.proposed_cluster_id = self._get_propagatable_cluster()
+
+        if cluster_id is not None:
+            certain_indices = list(
+                self.data_storage.X_train_unlabeled_cluster_indices[cluster_id]
+            )
+
+            certain_X = self.data_storage.X_train_unlabeled.loc[certain_indices]
+            recommended_labels = [
+                self.data_storage.cluster_label_counts[cluster_id].argmax()
+                for _ in certain_indices
+            ]
+            recommended_labels = pd.DataFrame(recommended_labels, index=certain_X.index)
+            #  log_it("Cluster ", cluster_id, certain_indices)
+        elif self.COARSER_LEVELS > 0 and self.data_storage.cluster_tree is not None:
+            certain_indices, label = self._get_coarser_cluster()
+            if certain_indices is not None:
+                certain_X = self.data_storage.X_train_unlabeled.loc[certain_indices]
+                recommended_labels = pd.DataFrame(
+                    [label for _ in certain_indices], index=certain_X.index
                 )
+        return certain_X, recommended_labels, certain_indices, "C"
 
-                if (
-                    frequencies.most_common(1)[0][1]
-                    > len(cluster_indices) * self.MINIMUM_RATIO_LABELED_UNLABELED
-                ):
-                    certain_indices = self.data_storage.X_train_unlabeled_cluster_indices[
-                        cluster_id
-                    ]
-
-                    certain_X = self.data_storage.X_train_unlabeled.loc[certain_indices]
-                    recommended_labels = [
-                        frequencies.most_common(1)[0][0] for _ in certain_indices
-                    ]
-                    recommended_labels = pd.DataFrame(
-                        recommended_labels, index=certain_X.index
-                    )
-                    #  log_it("Cluster ", cluster_id, certain_indices)
-                    cluster_found = True
-                    break
+    def commit_labeled_samples(self):
+        if self.proposed_cluster_id is None:
+            return
 
         # delete this cluster from the list of possible cluster for the next round
-        if cluster_found:
-            self.data_storage.X_train_labeled_cluster_indices.pop(cluster_id)
-        return certain_X, recommended_labels, certain_indices, "C"
+        heapq.heappop(self.propagatable_clusters)
+        self.data_storage.X_train_labeled_cluster_indices.pop(
+            self.proposed_cluster_id, None
+        )
+        self.proposed_cluster_id = None
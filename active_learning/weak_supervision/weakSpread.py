@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+from ..experiment_setup_lib import log_it
+from .baseWeakSupervision import BaseWeakSupervision
+
+
+class WeakSpread(BaseWeakSupervision):
+    """Spreads the known labels over the cached kNN graph of the whole pool
+
+    The spreading is iterated until convergence on the first call and whenever many new
+    labels have arrived since, in between the label distributions of the previous call
+    are used as the starting point for a few sparse matrix multiplications. Nothing is
+    returned before every class has a label, and the confidence of a sample is measured
+    against a uniform floor, so samples which barely got any mass are never certain.
+    Only the strong (G/A) labels are spread, and samples are only returned if the
+    neighbors of the strongly labeled samples predict those labels with at least
+    MINIMUM_CONFIDENCE precision.
+    """
+
+    # threshold param
+    MINIMUM_CONFIDENCE = None
+    ALPHA = 0.9
+    N_NEIGHBORS = 10
+    ITERATIONS_PER_CALL = 5
+    MAX_ITERATIONS = 1000
+    TOLERANCE = 1e-6
+    # a full solve again if the amount of labels has grown by this ratio
+    NEW_LABELS_RATIO = 0.2
+    # uniform mass per class, relative to the mean mass per class of the unlabeled pool
+    MASS_FLOOR_RATIO = 0.5
+    # confidently predicted labeled samples needed to estimate the precision
+    MINIMUM_VALIDATION_SAMPLES = 10
+    N_JOBS = -1
+
+    label_distributions = None
+    converged_amount_of_labels = 0
+    # (label_distributions, converged_amount_of_labels) of the last call, kept only if
+    # this source is asked
+    pending_state = None
+
+    def propagate(self, knn_graph, Y_static, label_distributions, max_iterations):
+        for _ in range(max_iterations):
+            new_label_distributions = (
+                self.ALPHA * (knn_graph @ label_distributions)
+                + (1 - self.ALPHA) * Y_static
+            )
+            change = np.abs(new_label_distributions - label_distributions).max()
+            label_distributions = new_label_distributions
+            if change < self.TOLERANCE:
+                return label_distributions, True
+        return label_distributions, False
+
+    def get_confidences(self, label_distributions, floor):
+        n_classes = label_distributions.shape[1]
+        return (label_distributions.max(axis=1) + floor) / (
+            label_distributions.sum(axis=1) + n_classes * floor
+        )
+
+    def is_precise_enough(
+        self, knn_graph, label_distributions, labeled_positions, labels, floor
+    ):
+        # the neighbors of the strongly labeled samples have to predict their labels
+        # with the required confidence, otherwise the graph doesn't fit the classes
+        neighbor_distributions = knn_graph[labeled_positions] @ label_distributions
+        certain = (
+            self.get_confidences(neighbor_distributions, floor)
+            > self.MINIMUM_CONFIDENCE
+        )
+        if np.sum(certain) < self.MINIMUM_VALIDATION_SAMPLES:
+            return False
+
+        precision = np.mean(
+            neighbor_distributions[certain].argmax(axis=1) == labels[certain]
+        )
+        log_it("Label spreading precision on labeled samples: " + str(precision))
+        return precision >= self.MINIMUM_CONFIDENCE
+
+    def get_labeled_samples(self):
+        X_weak = Y_weak = weak_indices = None
+        self.pending_state = None
+
+        n_classes = len(self.data_storage.label_encoder.classes_)
+        # only strong labels are spread, weak labels would confirm their own errors
+        Y_train_labeled = self.data_storage.Y_train_labeled
+        strong_labels = Y_train_labeled[Y_train_labeled.source.isin(["G", "A"])]
+        labeled_positions = self.data_storage.get_pool_positions(strong_labels.index)
+        labels = strong_labels[0].to_numpy()
+
+        # samples of a class without any label would all end up in the wrong class
+        if len(np.unique(labels)) < n_classes:
+            return X_weak, Y_weak, weak_indices, "P"
+
+        knn_graph = self.data_storage.get_knn_graph(self.N_NEIGHBORS, self.N_JOBS)
+        Y_static = np.zeros((knn_graph.shape[0], n_classes))
+        Y_static[labeled_positions, labels] = 1
+
+        converged_amount_of_labels = self.converged_amount_of_labels
+        if self.label_distributions is None or len(labeled_positions) > (
+            1 + self.NEW_LABELS_RATIO
+        ) * converged_amount_of_labels:
+            if self.label_distributions is None:
+                all_label_distributions = Y_static.copy()
+            else:
+                all_label_distributions = self.label_distributions
+            all_label_distributions, converged = self.propagate(
+                knn_graph, Y_static, all_label_distributions, self.MAX_ITERATIONS
+            )
+            if not converged:
+                # not converged yet, the next call goes on with the full solve
+                self.pending_state = (
+                    all_label_distributions,
+                    converged_amount_of_labels,
+                )
+                return X_weak, Y_weak, weak_indices, "P"
+            converged_amount_of_labels = len(labeled_positions)
+        else:
+            # warm start from the previous solution
+            all_label_distributions, _ = self.propagate(
+                knn_graph,
+                Y_static,
+                self.label_distributions,
+                self.ITERATIONS_PER_CALL,
+            )
+        self.pending_state = (all_label_distributions, converged_amount_of_labels)
+
+        unlabeled_positions = np.flatnonzero(self.data_storage.pool_unlabeled_mask)
+        label_distributions = all_label_distributions[unlabeled_positions]
+        masses = label_distributions.sum(axis=1)
+        if len(masses) == 0 or masses.mean() <= 0:
+            return X_weak, Y_weak, weak_indices, "P"
+
+        # a uniform floor for every class, a sample reached by only one class with
+        # little mass stays close to the uniform distribution
+        floor = self.MASS_FLOOR_RATIO * masses.mean() / n_classes
+        confidences = self.get_confidences(label_distributions, floor)
+        certain = confidences > self.MINIMUM_CONFIDENCE
+
+        if np.any(certain) and not self.is_precise_enough(
+            knn_graph, all_label_distributions, labeled_positions, labels, floor
+        ):
+            return X_weak, Y_weak, weak_indices, "P"
+
+        if np.any(certain):
+            weak_indices = self.data_storage.pool_index[
+                unlabeled_positions[certain]
+            ].tolist()
+            X_weak = self.data_storage.X_train_unlabeled.loc[weak_indices]
+            Y_weak = pd.DataFrame(
+                label_distributions[certain].argmax(axis=1), index=X_weak.index
+            )
+
+        return X_weak, Y_weak, weak_indices, "P"
+
+    def commit_labeled_samples(self):
+        if self.pending_state is not None:
+            self.label_distributions, self.converged_amount_of_labels = (
+                self.pending_state
+            )
+            self.pending_state = None
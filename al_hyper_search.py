@@ -10,9 +10,13 @@ from collections import defaultdict
 import pandas as pd
 from evolutionary_search import EvolutionaryAlgorithmSearchCV
 from sklearn.base import BaseEstimator
-from sklearn.model_selection import RandomizedSearchCV, ShuffleSplit
+from sklearn.model_selection import ParameterSampler, ShuffleSplit
 
 from active_learning.al_cycle_wrapper import train_and_eval_dataset
+from active_learning.experimentScheduler import ExperimentScheduler
+from active_learning.parallelismGovernor import ParallelismGovernor
+from active_learning.searchCheckpoint import SearchCheckpoint
+from active_learning.successiveHalving import SuccessiveHalvingSearch
 from active_learning.experiment_setup_lib import (
     get_dataset,
     get_param_distribution,
@@ -33,11 +37,21 @@ standard_config = standard_config(
         (["--GENE_MUTATION_PROB"], {"type": float, "default": 0.3}),
         (["--OUTPUT_DIRECTORY"], {"default": "tmp/"}),
         (["--HYPER_SEARCH_TYPE"], {"default": "random"}),
+        (["--CORES_PER_RUN"], {"type": int, "default": 1}),
+        (["--HALVING_MIN_ITERATIONS"], {"type": int, "default": 5}),
+        (["--HALVING_FACTOR"], {"type": int, "default": 3}),
     ]
 )
 init_logger(standard_config.LOG_FILE)
 param_distribution = get_param_distribution(**vars(standard_config))
 
+# concurrent runs x threads per run never exceed N_JOBS cores
+governor = ParallelismGovernor(
+    standard_config.N_JOBS, threads_per_run=standard_config.CORES_PER_RUN
+)
+param_distribution["N_JOBS"] = [governor.threads_per_run]
+param_distribution["GROUP_COLUMN"] = [standard_config.GROUP_COLUMN]
+
 
 class Estimator(BaseEstimator):
     # dirty hack to allow kwargs in init :)
@@ -56,6 +70,7 @@ class Estimator(BaseEstimator):
 
     def fit(self, dataset_names, Y_not_used, **kwargs):
         init_logger(standard_config.LOG_FILE)
+        governor.limit_threads()
         if self.RANDOM_SEED == -2:
             self.RANDOM_SEED = random.randint(0, 2147483647)
             np.random.seed(self.RANDOM_SEED)
@@ -68,9 +83,25 @@ class Estimator(BaseEstimator):
                 continue
             #  gc.collect()
 
-            X_train, X_test, Y_train, Y_test, label_encoder_classes = get_dataset(
-                standard_config.DATASETS_PATH, dataset_name, self.RANDOM_SEED
-            )
+            if self.GROUP_COLUMN is None:
+                groups = None
+                X_train, X_test, Y_train, Y_test, label_encoder_classes = get_dataset(
+                    standard_config.DATASETS_PATH, dataset_name, self.RANDOM_SEED
+                )
+            else:
+                (
+                    X_train,
+                    X_test,
+                    Y_train,
+                    Y_test,
+                    label_encoder_classes,
+                    groups,
+                ) = get_dataset(
+                    standard_config.DATASETS_PATH,
+                    dataset_name,
+                    self.RANDOM_SEED,
+                    group_column=self.GROUP_COLUMN,
+                )
             score, Y_train_al = train_and_eval_dataset(
                 dataset_name,
                 X_train,
@@ -78,8 +109,9 @@ class Estimator(BaseEstimator):
                 Y_train,
                 Y_test,
                 label_encoder_classes,
-                hyper_parameters=vars(self),
+                hyper_parameters=governor.apply(dict(vars(self))),
                 oracle=FakeExperimentOracle(),
+                groups=groups,
             )
 
             self.scores.append(score)
@@ -107,41 +139,66 @@ else:
         #  "zebra",
     ]
 
-X.append(None)
-Y = [None] * len(X)
-
-
-# fake our own stupid cv=1 split
-class NoCvCvSplit:
-    def __init__(self, n_splits=3, **kwargs):
-        self.n_splits = n_splits
-        pass
-
-    def get_n_splits(self, X, y, groups=None):
-        return self.n_splits
+if standard_config.HYPER_SEARCH_TYPE in ("random", "halving"):
+    scheduler = ExperimentScheduler(
+        n_jobs=standard_config.N_JOBS,
+        cores_per_run=standard_config.CORES_PER_RUN,
+        log_file=standard_config.LOG_FILE,
+    )
 
-    def split(self, dataset_names, y=None, groups=None, split_quota=None):
-        # everything goes into train once
-        train_idx = [i for i in range(0, len(dataset_names) - 1)]
+    # a restarted search replays the same samples and skips the finished runs
+    checkpoint = SearchCheckpoint(
+        standard_config.OUTPUT_DIRECTORY, standard_config.RANDOM_SEED
+    )
 
-        yield train_idx, [len(dataset_names) - 1]
+    # the samples are drawn lazily, only as many as there are free workers
+    hyper_parameter_samples = checkpoint.prepare_samples(
+        ParameterSampler(
+            param_distribution,
+            n_iter=standard_config.NR_RANDOM_RUNS,
+            random_state=checkpoint.random_state,
+        )
+    )
 
+    if standard_config.HYPER_SEARCH_TYPE == "halving":
+        # the iterations are the budget, only the best configs get more of them
+        search = SuccessiveHalvingSearch(
+            scheduler,
+            standard_config.OUTPUT_DIRECTORY + "/halving/",
+            min_iterations=standard_config.HALVING_MIN_ITERATIONS,
+            max_iterations=standard_config.NR_LEARNING_ITERATIONS,
+            factor=standard_config.HALVING_FACTOR,
+        )
+    else:
+        search = scheduler
+
+    results = []
+    with scheduler:
+        for hyper_parameters, dataset_name, score, run_time in search.run(
+            hyper_parameter_samples, X, FakeExperimentOracle, checkpoint=checkpoint
+        ):
+            log_it(
+                "{} done with {} after {:.1f}s".format(dataset_name, score, run_time)
+            )
+            results.append(
+                dict(hyper_parameters, DATASET_NAME=dataset_name, score=score)
+            )
 
-if standard_config.HYPER_SEARCH_TYPE == "random":
-    grid = RandomizedSearchCV(
-        active_learner,
-        param_distribution,
-        n_iter=standard_config.NR_RANDOM_RUNS,
-        pre_dispatch=standard_config.N_JOBS,
-        return_train_score=False,
-        cv=NoCvCvSplit(n_splits=1),
-        verbose=9999999999999999999999999999999999,
-        # verbose=0,
-        n_jobs=standard_config.N_JOBS,
-        refit=False,
-    )
-    grid = grid.fit(X, Y)
+    results = pd.DataFrame(results)
+    if standard_config.HYPER_SEARCH_TYPE == "halving":
+        # only the runs with the full budget are comparable
+        results = results[
+            results["NR_LEARNING_ITERATIONS"]
+            == results["NR_LEARNING_ITERATIONS"].max()
+        ]
+    best_result = results.sort_values("score", ascending=False).iloc[0]
+    print(best_result.to_dict())
+    print(best_result["score"])
+    print(results.sort_values("score", ascending=False).head())
 elif standard_config.HYPER_SEARCH_TYPE == "evo":
+    X.append(None)
+    Y = [None] * len(X)
+
     grid = EvolutionaryAlgorithmSearchCV(
         estimator=active_learner,
         params=param_distribution,
@@ -151,14 +208,14 @@ elif standard_config.HYPER_SEARCH_TYPE == "evo":
         gene_mutation_prob=standard_config.GENE_MUTATION_PROB,
         tournament_size=standard_config.TOURNAMENT_SIZE,
         generations_number=standard_config.GENERATIONS_NUMBER,
-        n_jobs=standard_config.N_JOBS,
+        n_jobs=governor.n_workers,
     )
     grid.fit(X, Y)
 
-print(grid.best_params_)
-print(grid.best_score_)
-print(
-    pd.DataFrame(grid.cv_results_)
-    .sort_values("mean_test_score", ascending=False)
-    .head()
-)
+    print(grid.best_params_)
+    print(grid.best_score_)
+    print(
+        pd.DataFrame(grid.cv_results_)
+        .sort_values("mean_test_score", ascending=False)
+        .head()
+    )
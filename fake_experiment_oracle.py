@@ -1,6 +1,24 @@
+import asyncio
+import time
+
 from active_learning.BaseOracle import BaseOracle
 
 
 class FakeExperimentOracle(BaseOracle):
     def get_labeled_samples(self, query_indices, data_storage):
         return data_storage.Y_train_unlabeled.loc[query_indices]
+
+
+class FakeAnnotatorOracle(FakeExperimentOracle):
+    """In-process stand-in for a human annotator who needs some time per label"""
+
+    def __init__(self, seconds_per_label=0.0):
+        self.seconds_per_label = seconds_per_label
+
+    def get_labeled_samples(self, query_indices, data_storage):
+        time.sleep(self.seconds_per_label * len(query_indices))
+        return super().get_labeled_samples(query_indices, data_storage)
+
+    async def get_labeled_samples_async(self, query_indices, data_storage):
+        await asyncio.sleep(self.seconds_per_label * len(query_indices))
+        return super().get_labeled_samples(query_indices, data_storage)
@@ -0,0 +1,79 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from active_learning.experiment_setup_lib import get_dataset
+
+
+class FakeLabelingRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        # a human needs some time per label
+        time.sleep(self.server.seconds_per_label * len(request["indices"]))
+
+        labels = [self.server.labels.get(index) for index in request["indices"]]
+        body = json.dumps({"labels": labels}).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_labeling_server(
+    Y_train, label_encoder_classes, host="127.0.0.1", port=0, seconds_per_label=0.0
+):
+    """Serves the known labels of Y_train in a background thread, returns the server and its url
+
+    Stand-in for the real labeling service, so that the HttpOracle can be load tested offline.
+    """
+    server = ThreadingHTTPServer((host, port), FakeLabelingRequestHandler)
+    server.daemon_threads = True
+    server.seconds_per_label = seconds_per_label
+    server.labels = {}
+    for index, label in Y_train[0].items():
+        label = label_encoder_classes[label]
+        server.labels[index] = label.item() if isinstance(label, np.generic) else label
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}/label".format(*server.server_address)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--DATASETS_PATH", default="../datasets/")
+    parser.add_argument("--DATASET_NAME", required=True)
+    parser.add_argument("--RANDOM_SEED", type=int, default=42)
+    parser.add_argument("--HOST", default="127.0.0.1")
+    parser.add_argument("--PORT", type=int, default=8080)
+    parser.add_argument("--SECONDS_PER_LABEL", type=float, default=0.0)
+    config = parser.parse_args()
+
+    X_train, X_test, Y_train, Y_test, label_encoder_classes = get_dataset(
+        config.DATASETS_PATH, config.DATASET_NAME, config.RANDOM_SEED
+    )
+    server, url = start_fake_labeling_server(
+        Y_train,
+        label_encoder_classes,
+        host=config.HOST,
+        port=config.PORT,
+        seconds_per_label=config.SECONDS_PER_LABEL,
+    )
+    print("Serving labels of " + config.DATASET_NAME + " at " + url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
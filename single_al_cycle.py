@@ -6,7 +6,11 @@ from active_learning.experiment_setup_lib import (
     standard_config,
     init_logger,
 )
-from fake_experiment_oracle import FakeExperimentOracle
+from active_learning.httpOracle import HttpOracle
+from active_learning.oracleDispatcher import OracleDispatcher
+from active_learning.parallelismGovernor import ParallelismGovernor
+from fake_experiment_oracle import FakeAnnotatorOracle, FakeExperimentOracle
+from fake_labeling_server import start_fake_labeling_server
 
 config = standard_config(
     [
@@ -14,7 +18,7 @@ config = standard_config(
             ["--SAMPLING"],
             {
                 "required": True,
-                "help": "Possible values: uncertainty, random, committe, boundary",
+                "help": "Possible values: uncertainty, random, committe, boundary, coreset, density_uncertainty",
             },
         ),
         (["--DATASET_NAME"], {"required": True,}),
@@ -25,6 +29,23 @@ config = standard_config(
                 "help": "Possible values: dummy, random, mostUncertain, roundRobin",
             },
         ),
+        (
+            ["--DIMENSIONALITY_REDUCTION"],
+            {
+                "default": None,
+                "help": "Possible values: pca, randomized_pca, random_projection",
+            },
+        ),
+        (["--DIMENSIONALITY_REDUCTION_COMPONENTS"], {"type": int, "default": 50}),
+        (
+            ["--RECLUSTER_POOL_SHRINK_RATIO"],
+            {
+                "type": float,
+                "default": None,
+                "help": "Merge small clusters every time the unlabeled pool shrank to this ratio",
+            },
+        ),
+        (["--RECLUSTER_MINIMUM_CLUSTER_SIZE"], {"type": int, "default": 2}),
         (["--NR_LEARNING_ITERATIONS"], {"type": int, "default": 150000}),
         (["--NR_QUERIES_PER_ITERATION"], {"type": int, "default": 150}),
         (["--START_SET_SIZE"], {"type": int, "default": 1}),
@@ -46,9 +67,23 @@ config = standard_config(
             ["--CLUSTER_RECOMMENDATION_RATIO_LABELED_UNLABELED"],
             {"type": float, "default": 0.9},
         ),
+        (["--CLUSTER_RECOMMENDATION_COARSER_LEVELS"], {"type": int, "default": 0}),
         (["--WITH_UNCERTAINTY_RECOMMENDATION"], {"action": "store_true"}),
         (["--WITH_CLUSTER_RECOMMENDATION"], {"action": "store_true"}),
         (["--WITH_SNUBA_LITE"], {"action": "store_true"}),
+        (["--WITH_LABEL_SPREADING"], {"action": "store_true"}),
+        (["--LABEL_SPREADING_MINIMUM_CONFIDENCE"], {"type": float, "default": 0.9}),
+        (["--WITH_LABEL_MODEL"], {"action": "store_true"}),
+        (["--LABEL_MODEL_MINIMUM_CONFIDENCE"], {"type": float, "default": 0.9}),
+        (["--ASYNC_ORACLE"], {"action": "store_true"}),
+        (["--NR_ANNOTATORS"], {"type": int, "default": 1}),
+        (["--ANNOTATOR_SECONDS_PER_LABEL"], {"type": float, "default": 0}),
+        (["--ANNOTATOR_TIMEOUT"], {"type": float, "default": None}),
+        (["--ANNOTATOR_MINIMUM_BATCH_FRACTION"], {"type": float, "default": 1.0}),
+        (["--LABELING_SERVICE_URL"], {"default": None}),
+        (["--START_FAKE_LABELING_SERVER"], {"action": "store_true"}),
+        (["--LABEL_LEDGER"], {"default": None}),
+        (["--SPECULATIVE_QUERIES_FACTOR"], {"type": int, "default": None}),
         (["--PLOT"], {"action": "store_true"}),
         (["--STOPPING_CRITERIA_UNCERTAINTY"], {"type": float, "default": 0.7}),
         (["--STOPPING_CRITERIA_ACC"], {"type": float, "default": 0.7}),
@@ -70,9 +105,53 @@ if config.RANDOM_SEED == -2:
     np.random.seed(config.RANDOM_SEED)
     random.seed(config.RANDOM_SEED)
 
-X_train, X_test, Y_train, Y_test, label_encoder_classes = get_dataset(
-    config.DATASETS_PATH, config.DATASET_NAME, config.RANDOM_SEED
-)
+if config.GROUP_COLUMN is None:
+    groups = None
+    X_train, X_test, Y_train, Y_test, label_encoder_classes = get_dataset(
+        config.DATASETS_PATH, config.DATASET_NAME, config.RANDOM_SEED
+    )
+else:
+    X_train, X_test, Y_train, Y_test, label_encoder_classes, groups = get_dataset(
+        config.DATASETS_PATH,
+        config.DATASET_NAME,
+        config.RANDOM_SEED,
+        group_column=config.GROUP_COLUMN,
+    )
+
+if config.START_FAKE_LABELING_SERVER:
+    # local stand-in for the labeling service, the annotators' delay is simulated by the server
+    labeling_server, config.LABELING_SERVICE_URL = start_fake_labeling_server(
+        Y_train,
+        label_encoder_classes,
+        seconds_per_label=config.ANNOTATOR_SECONDS_PER_LABEL,
+    )
+
+if config.LABELING_SERVICE_URL is not None:
+    annotators = [
+        HttpOracle(config.LABELING_SERVICE_URL, annotator=i)
+        for i in range(config.NR_ANNOTATORS)
+    ]
+else:
+    annotators = [
+        FakeAnnotatorOracle(config.ANNOTATOR_SECONDS_PER_LABEL)
+        for _ in range(config.NR_ANNOTATORS)
+    ]
+
+if config.NR_ANNOTATORS > 1:
+    # several annotators label the shards of each batch concurrently
+    oracle = OracleDispatcher(
+        annotators,
+        timeouts=config.ANNOTATOR_TIMEOUT,
+        minimum_batch_fraction=config.ANNOTATOR_MINIMUM_BATCH_FRACTION,
+    )
+elif config.LABELING_SERVICE_URL is not None or config.ANNOTATOR_SECONDS_PER_LABEL > 0:
+    oracle = annotators[0]
+else:
+    oracle = FakeExperimentOracle()
+
+# a single run gets all cores, shared by the classifier and the BLAS thread pools
+governor = ParallelismGovernor(config.N_JOBS, n_workers=1)
+governor.limit_threads()
 
 score, Y_train = train_and_eval_dataset(
     config.DATASET_NAME,
@@ -81,8 +160,9 @@ score, Y_train = train_and_eval_dataset(
     Y_train,
     Y_test,
     label_encoder_classes,
-    hyper_parameters=vars(config),
-    oracle=FakeExperimentOracle(),
+    hyper_parameters=governor.apply(vars(config)),
+    oracle=oracle,
+    groups=groups,
 )
 print("Done with ", score)
 print("Labels: ", Y_train)